@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from main import app
+
+
+# Build the WSGI environ for an ASGI HTTP request whose body is read from the given stream
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    # ASGI servers include the root path in `path`; WSGI expects it in SCRIPT_NAME only
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode().decode('latin-1'),
+        'PATH_INFO': path.encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The stream ends with the request body, so a chunked upload without Content-Length can be read to the end
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+# Raw stream for wsgi.input: yields the chunks already read on the event loop, then pulls the rest of the body
+# from the ASGI receive channel as the handler reads it. A client that disconnects ends the stream early.
+class RequestBody(io.RawIOBase):
+    def __init__(self, chunks, receive, loop):
+        self.chunks = collections.deque(memoryview(chunk) for chunk in chunks)
+        self.more_body = True
+        self.receive = receive
+        self.loop = loop
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunks:
+            if not self.more_body:
+                return 0
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                self.more_body = False
+                return 0
+            self.more_body = message.get('more_body', False)
+            if message.get('body'):
+                self.chunks.append(memoryview(message['body']))
+        chunk = self.chunks[0]
+        size = min(len(buffer), len(chunk))
+        buffer[:size] = chunk[:size]
+        if size == len(chunk):
+            self.chunks.popleft()
+        else:
+            self.chunks[0] = chunk[size:]
+        return size
+
+
+# Serves a WSGI app to an ASGI server. The event loop accepts connections and reads request bodies of up to
+# buffer_size bytes, so idle clients and slow small uploads cost no thread; the blocking handlers run on a bounded
+# thread pool. A larger body is streamed to its handler as it reads wsgi.input, so memory stays bounded and
+# werkzeug's MAX_CONTENT_LENGTH and form limits apply as they do under a WSGI server.
+class WSGIAdapter:
+    def __init__(self, wsgi_app, threads, buffer_size=64 * 1024):
+        self.wsgi_app = wsgi_app
+        self.buffer_size = buffer_size
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-handler')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        loop = asyncio.get_running_loop()
+        chunks, size, more_body = [], 0, True
+        while more_body and size < self.buffer_size:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            if message.get('body'):
+                chunks.append(message['body'])
+                size += len(message['body'])
+            more_body = message.get('more_body', False)
+        # A complete body is wrapped without copying it; the rest of a larger one is read by the handler
+        body = io.BufferedReader(RequestBody(chunks, receive, loop)) if more_body else io.BytesIO(b''.join(chunks))
+        # Like asyncio.to_thread, the handler sees the caller's context variables
+        context = contextvars.copy_context()
+        await loop.run_in_executor(self.executor, context.run, self.run, loop, scope, body, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Runs on a pool thread; response chunks are handed back to the event loop as they are produced
+    def run(self, loop, scope, body, send):
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {'sent': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }
+
+        iterable = self.wsgi_app(build_environ(scope, body), start_response)
+        try:
+            for chunk in iterable:
+                if not chunk:
+                    continue
+                # Headers go out with the first chunk, so an error raised before it can still change them
+                if not response['sent']:
+                    send_sync(response['start'])
+                    response['sent'] = True
+                send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not response['sent']:
+                send_sync(response['start'])
+            send_sync({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+
+# One handler thread per pooled database connection, so handlers never queue for a connection
+application = WSGIAdapter(app, int(os.environ.get(
+    'ASGI_THREADS', app.config['DB_POOL_SIZE'] + app.config['DB_MAX_OVERFLOW'])))
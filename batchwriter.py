@@ -0,0 +1,142 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Raised by BatchWriter.submit when the backlog stays full for longer than its timeout; `items` are the submitted
+# items that were not queued
+class BacklogFull(Exception):
+    def __init__(self, items):
+        super().__init__(f'{len(items)} items could not be queued')
+        self.items = items
+
+
+# Background writer that collects submitted items into batches and hands each batch to `flush`.
+# The backlog is bounded: submit blocks while it is full, which slows producers down to the flush rate, and raises
+# BacklogFull once it has waited `submit_timeout` seconds. A failed batch is retried `attempts` times with backoff;
+# then its items are written one at a time and any that still fail are passed to `on_failed(item, error)` and
+# set aside, so one bad item cannot hold up the rest. `on_error` is called with the exception each time a flush
+# fails.
+class BatchWriter:
+    def __init__(self, flush, max_backlog=10000, batch_size=500, flush_interval=0.05, max_backoff=5.0,
+                 attempts=5, submit_timeout=None, on_error=None, on_failed=None):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.attempts = attempts
+        self.submit_timeout = submit_timeout
+        self.on_error = on_error
+        self.on_failed = on_failed
+        self._queue = queue.Queue(maxsize=max_backlog)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, items):
+        self.start()
+        deadline = None if self.submit_timeout is None else time.monotonic() + self.submit_timeout
+        for position, item in enumerate(items):
+            try:
+                self._queue.put(item, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Full:
+                raise BacklogFull(items[position:]) from None
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    # Block until everything submitted so far has been flushed, or for at most `timeout` seconds.
+    # Returns whether the backlog was drained.
+    def drain(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    # Flush the remaining backlog, then stop the worker thread. Items still queued after `timeout` seconds are
+    # set aside instead of written, so shutdown cannot hang on a failing sink.
+    def stop(self, timeout=None):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        drained = self.drain(timeout)
+        self._stopping.set()
+        if not drained:
+            logger.error('Stopping with %d items still queued; setting them aside', self.backlog())
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._set_aside(item, TimeoutError('the writer was stopped before the item was written'))
+                self._queue.task_done()
+        thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    # Retry a failed batch, backing off exponentially up to max_backoff seconds. If it still fails, write its
+    # items one at a time and set aside only those that fail on their own.
+    def _flush(self, batch):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                self.flush(batch)
+                return
+            except Exception as error:
+                logger.exception('Batch write of %d items failed (attempt %d of %d)', len(batch), attempt,
+                                 self.attempts)
+                self._failed(error)
+                last_error = error
+                # A stopping writer gives up on the batch at once rather than sleeping through its retries
+                if attempt == self.attempts or self._stopping.is_set():
+                    break
+                time.sleep(min(self.max_backoff, self.flush_interval * 2 ** (attempt - 1)))
+        if len(batch) == 1:
+            self._set_aside(batch[0], last_error)
+            return
+        for item in batch:
+            try:
+                self.flush([item])
+            except Exception as error:
+                self._failed(error)
+                self._set_aside(item, error)
+
+    def _failed(self, error):
+        if self.on_error is not None:
+            self.on_error(error)
+
+    def _set_aside(self, item, error):
+        logger.error('Setting aside an item that could not be written: %s', error)
+        if self.on_failed is not None:
+            try:
+                self.on_failed(item, error)
+            except Exception:
+                logger.exception('Could not set aside an item; it is lost')
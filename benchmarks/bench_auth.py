@@ -0,0 +1,50 @@
+"""Compare GET /notes/<id> throughput with credential lookup and with a cached JWT.
+
+Usage: python benchmarks/bench_auth.py [requests]
+"""
+import sys
+import time
+
+from common import setup
+
+setup('bench_auth.db')
+
+from main import app, db, User, Notes  # noqa: E402
+
+
+def run(client, note_id, count, **kwargs):
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.get(f'/notes/{note_id}', **kwargs)
+        assert response.status_code == 200, response.data
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        # Pad the user table so the credential lookup is not against a single row
+        db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com', password='pw')
+                            for i in range(10000)])
+        user = User(username='bench', email='bench@example.com', password='bench_password')
+        db.session.add(user)
+        db.session.commit()
+        note = Notes(user_id=user.userid, post_content='Benchmark note')
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.note_id
+
+    credentials = {'username': 'bench', 'password': 'bench_password'}
+    token = client.post('/login', json=credentials).get_json()['token']
+
+    credential_rps = run(client, note_id, count, json=credentials)
+    token_rps = run(client, note_id, count, headers={'Authorization': f'Bearer {token}'})
+
+    print(f'credential lookup: {credential_rps:8.0f} req/s')
+    print(f'cached token:      {token_rps:8.0f} req/s ({token_rps / credential_rps:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
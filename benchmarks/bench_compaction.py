@@ -0,0 +1,115 @@
+"""Measure `flask compact-history` on a seeded history, and its effect on concurrent note updates.
+
+Seeds notes whose versions span the last few months, then runs the compaction while a writer thread keeps
+updating notes. Reports rows and bytes reclaimed, the database file size before and after, compaction time,
+and update latency without and during the compaction, for full and delta history storage.
+
+Usage: python benchmarks/bench_compaction.py [--notes 500] [--versions 200] [--batch-size 200]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common import percentile, setup
+
+
+# Keep sending updates to random notes until stopped, recording each one's latency
+def writer(app, headers, note_ids, stop, latencies):
+    client = app.test_client()
+    rng = random.Random(0)
+    while not stop.is_set():
+        note_id = rng.choice(note_ids)
+        start = time.perf_counter()
+        response = client.put(f'/notes/{note_id}', json={'content': f'edit {rng.random()}\n'}, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+
+
+def seed(app, db, Notes, add_version, args):
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    note_ids = []
+    with app.app_context():
+        for _ in range(args.notes):
+            note = Notes(user_id=1, post_content='')
+            db.session.add(note)
+            db.session.flush()
+            note_ids.append(note.note_id)
+            lines = [f'line {i} of a note that is edited over time\n' for i in range(40)]
+            # Versions spread over the last 90 days, several a day
+            for i in range(args.versions):
+                lines[rng.randrange(len(lines))] = f'edited line {rng.random()}\n'
+                add_version(note.note_id, ''.join(lines),
+                            now - timedelta(days=90 * (args.versions - i) / args.versions))
+            db.session.commit()
+    return note_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=500)
+    parser.add_argument('--versions', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--storage', default='full,delta')
+    args = parser.parse_args()
+
+    print(f'{args.notes} notes x {args.versions} versions over 90 days; keep last 50, 30 days, then daily')
+    print(f'{"storage":<8} {"rows deleted":>13} {"content MB":>11} {"file MB":>15} {"seconds":>8} '
+          f'{"PUT p50/p99 ms idle":>20} {"during":>14}')
+    for storage in args.storage.split(','):
+        # Each storage mode gets a fresh process-wide app, so import main against its own database
+        setup('bench_compaction.db')
+        os.environ['HISTORY_STORAGE'] = storage
+        os.environ['PASSWORD_HASH_ITERATIONS'] = '1000'
+        for module in ('main', 'asgi'):
+            sys.modules.pop(module, None)
+        import main
+        app, db = main.app, main.db
+        with app.app_context():
+            main.init_db()
+            db.session.add(main.User(username='bench', email='bench@example.com', password='pw'))
+            db.session.commit()
+        note_ids = seed(app, db, main.Notes, main.add_version, args)
+        token = app.test_client().post('/login', json={'username': 'bench', 'password': 'pw'}).get_json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        def measure(seconds=None, work=None):
+            latencies = []
+            stop = threading.Event()
+            thread = threading.Thread(target=writer, args=(app, headers, note_ids, stop, latencies))
+            thread.start()
+            start = time.perf_counter()
+            result = work() if work else time.sleep(seconds)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            thread.join()
+            return result, elapsed, [latency * 1000 for latency in latencies]
+
+        _, _, idle = measure(seconds=3)
+        with app.app_context():
+            size_before = main.database_size()[0]
+
+        def compact():
+            with app.app_context():
+                totals = {}
+                for totals in main.compact_history(50, 30, True, args.batch_size):
+                    pass
+                main.reclaim_free_pages(app.config['HISTORY_VACUUM_STEP_PAGES'])
+                return totals
+
+        totals, elapsed, during = measure(work=compact)
+        with app.app_context():
+            size_after = main.database_size()[0]
+        print(f'{storage:<8} {totals["rows_deleted"]:>13} {totals["bytes_reclaimed"] / 1e6:>11.1f} '
+              f'{f"{size_before / 1e6:.1f} -> {size_after / 1e6:.1f}":>15} {elapsed:>8.1f} '
+              f'{f"{percentile(idle, 0.5):.1f} / {percentile(idle, 0.99):.1f}":>20} '
+              f'{f"{percentile(during, 0.5):.1f} / {percentile(during, 0.99):.1f}":>14}')
+        main.history_writer.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Stress test: parallel editors appending lines to the same notes, checking for lost updates.
+
+Each editor repeatedly reads a note, appends one line and writes it back, in three modes:
+- last writer wins: PUT without a version, as before optimistic concurrency control
+- optimistic: PUT with If-Match, re-reading and retrying on 409
+- locking: each read-modify-write holds a lock for its note, serializing the editors of a note
+
+Usage: python benchmarks/bench_concurrency.py [--editors 8] [--edits 20] [--notes 1]
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from common import setup
+
+setup('bench_concurrency.db')
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from main import app, db, User, Notes, init_db  # noqa: E402
+
+
+def call(base_url, method, path, token, body=None, headers=()):
+    request = urllib.request.Request(base_url + path, method=method, data=json.dumps(body or {}).encode(),
+                                     headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}',
+                                              **dict(headers)})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read()), response.headers.get('ETag')
+    except urllib.error.HTTPError as error:
+        return error.code, None, None
+    except OSError:
+        return 599, None, None
+
+
+# Retry until the edit is written; failed requests are counted as errors rather than lost updates
+def edit(base_url, token, note_id, line, mode, counters):
+    while True:
+        status, note, etag = call(base_url, 'GET', f'/notes/{note_id}', token)
+        if status != 200:
+            counters['errors'] += 1
+            continue
+        content = note['content'] + line + '\n'
+        headers = {'If-Match': etag} if mode == 'optimistic' else {}
+        status, _, _ = call(base_url, 'PUT', f'/notes/{note_id}', token, {'content': content}, headers)
+        if status == 200:
+            return
+        counters['retries' if status == 409 else 'errors'] += 1
+        # Jittered backoff, so conflicting editors do not retry in lockstep
+        time.sleep(random.uniform(0, 0.01))
+
+
+def editor(base_url, token, note_ids, index, args, mode, locks, counters):
+    for i in range(args.edits):
+        note_id = note_ids[(index + i) % len(note_ids)]
+        line = f'editor{index}-{i}'
+        if mode == 'locking':
+            with locks[note_id]:
+                edit(base_url, token, note_id, line, mode, counters)
+        else:
+            edit(base_url, token, note_id, line, mode, counters)
+
+
+def run(base_url, token, user_id, args, mode):
+    with app.app_context():
+        notes = [Notes(user_id=user_id, post_content='') for _ in range(args.notes)]
+        db.session.add_all(notes)
+        db.session.commit()
+        note_ids = [note.note_id for note in notes]
+    locks = {note_id: threading.Lock() for note_id in note_ids}
+    counters = {'retries': 0, 'errors': 0}
+    threads = [threading.Thread(target=editor, args=(base_url, token, note_ids, index, args, mode, locks, counters))
+               for index in range(args.editors)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        lines = sum(len(note.post_content.splitlines()) for note in Notes.query.filter(Notes.note_id.in_(note_ids)))
+    edits = args.editors * args.edits
+    return edits / elapsed, counters['retries'], counters['errors'], edits - lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--editors', type=int, default=8)
+    parser.add_argument('--edits', type=int, default=20)
+    parser.add_argument('--notes', type=int, default=1)
+    args = parser.parse_args()
+
+    with app.app_context():
+        init_db()
+        user = User(username='bench', email='bench@example.com', password='pw')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.userid
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    request = urllib.request.Request(base_url + '/login', data=json.dumps({'username': 'bench', 'password': 'pw'})
+                                     .encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        token = json.loads(response.read())['token']
+
+    print(f'{args.editors} editors x {args.edits} edits on {args.notes} note(s)')
+    print(f'{"mode":<18} {"edits/s":>8} {"retries":>8} {"errors":>7} {"lost updates":>13}')
+    for mode in ('last writer wins', 'optimistic', 'locking'):
+        throughput, retries, errors, lost = run(base_url, token, user_id, args, mode)
+        print(f'{mode:<18} {throughput:>8.0f} {retries:>8} {errors:>7} {lost:>13}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
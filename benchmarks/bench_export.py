@@ -0,0 +1,94 @@
+"""Measure export and import throughput for a user with a large version history.
+
+Seeds one user with --notes notes and --versions versions in total, then streams the user's archive from
+GET /notes/export as newline-delimited JSON and gzip, and loads the gzip archive into a second user with
+POST /notes/import. Reports seconds, records per second, archive MB written or read per second, and peak RSS growth
+for each step.
+
+Usage: python benchmarks/bench_export.py [--notes 1000] [--versions 1000000]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from common import current_rss, peak_rss, reset_peak_rss, setup
+
+DB_PATH = setup('bench_export.db')
+
+from main import app, db, User, Notes, NoteVersionHistory, init_db  # noqa: E402
+
+
+def seed(args):
+    with app.app_context():
+        init_db()
+        for name in ('bench', 'restored'):
+            db.session.add(User(username=name, email=f'{name}@example.com', password='pw'))
+        db.session.commit()
+        user_id = User.query.filter_by(username='bench').first().userid
+        start = datetime.utcnow() - timedelta(days=365)
+        per_note = args.versions // args.notes
+        for _ in range(args.notes):
+            note = Notes(user_id=user_id, post_content='Final version of a note\n' * 8)
+            db.session.add(note)
+            db.session.flush()
+            db.session.execute(NoteVersionHistory.__table__.insert(), [
+                {'note_id': note.note_id, 'content': f'Version {i} of a note\n' * 8,
+                 'modified_date': start + timedelta(minutes=i), 'is_delta': False} for i in range(per_note)])
+            db.session.commit()
+        return args.notes * per_note
+
+
+def measure(name, records, run):
+    reset_peak_rss()
+    rss_before = current_rss()
+    start = time.perf_counter()
+    size = run()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<16} {elapsed:>8.1f} {records / elapsed:>12,.0f} {size / 2 ** 20 / elapsed:>8.1f} '
+          f'{max(0, peak_rss() - rss_before) / 2 ** 20:>13.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=1000)
+    parser.add_argument('--versions', type=int, default=1000000)
+    args = parser.parse_args()
+
+    versions = seed(args)
+    records = 1 + args.notes + versions
+    client = app.test_client()
+    tokens = {name: client.post('/login', json={'username': name, 'password': 'pw'}).get_json()['token']
+              for name in ('bench', 'restored')}
+    archive_path = os.path.join(os.path.dirname(DB_PATH), 'archive.ndjson.gz')
+
+    def export(compression):
+        def run():
+            size = 0
+            response = client.get(f'/notes/export?format={compression}', buffered=False,
+                                  headers={'Authorization': f'Bearer {tokens["bench"]}'})
+            with open(archive_path if compression == 'gzip' else os.devnull, 'wb') as archive:
+                for chunk in response.response:
+                    archive.write(chunk)
+                    size += len(chunk)
+            return size
+        return run
+
+    def load():
+        with open(archive_path, 'rb') as archive:
+            response = client.post('/notes/import', input_stream=archive, content_type='application/gzip',
+                                   content_length=os.path.getsize(archive_path),
+                                   headers={'Authorization': f'Bearer {tokens["restored"]}'})
+        assert response.status_code == 201, response.data
+        assert response.get_json()['imported']['versions'] == versions
+        return os.path.getsize(archive_path)
+
+    print(f'{args.notes} notes, {versions} versions; database {os.path.getsize(DB_PATH) / 2 ** 20:.0f} MB')
+    print(f'{"step":<16} {"seconds":>8} {"records/s":>12} {"MB/s":>8} {"peak RSS +MB":>13}')
+    measure('export ndjson', records, export('ndjson'))
+    measure('export gzip', records, export('gzip'))
+    measure('import gzip', records, load)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Measure /notes and /notes/shared latency for users with few and with many notes.
+
+Usage: python benchmarks/bench_listing.py [notes ...]   (default: 1000 10000 100000)
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import setup
+
+setup('bench_listing.db')
+
+from main import app, db, User, Notes, NotesShared, init_db  # noqa: E402
+
+REQUESTS = 300
+
+
+def seed(count):
+    db.drop_all()
+    init_db()
+    start = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'userid': 1, 'username': 'owner', 'email': 'owner@example.com', 'password': 'pw'},
+        {'userid': 2, 'username': 'reader', 'email': 'reader@example.com', 'password': 'pw'}])
+    db.session.execute(Notes.__table__.insert(), [
+        {'note_id': i, 'user_id': 1, 'post_content': 'x' * 2000, 'last_modified': start + timedelta(seconds=i),
+         'modified_date': start} for i in range(1, count + 1)])
+    db.session.execute(NotesShared.__table__.insert(), [
+        {'note_id': i, 'author_id': 1, 'shared_with_user_id': 2, 'note_last_modified': start + timedelta(seconds=i)}
+        for i in range(1, count + 1)])
+    db.session.commit()
+
+
+def percentiles(client, url, credentials):
+    timings = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        response = client.get(url, json=credentials)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.data
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    client = app.test_client()
+    print(f'{"notes":>7} {"listing":<30} {"p50 ms":>8} {"p99 ms":>8}')
+    for count in sizes:
+        with app.app_context():
+            seed(count)
+        owner = {'username': 'owner', 'password': 'pw'}
+        reader = {'username': 'reader', 'password': 'pw'}
+        # A cursor halfway through the listing, to show deep pages cost the same as the first
+        deep = client.get('/notes?limit=200&fields=note_id', json=owner).get_json()['next_cursor']
+        for _ in range(count // 400):
+            deep = client.get(f'/notes?limit=200&fields=note_id&cursor={deep}', json=owner).get_json()['next_cursor']
+        cases = {
+            '/notes': ('/notes', owner),
+            '/notes without content': ('/notes?fields=note_id,last_modified', owner),
+            '/notes deep page': (f'/notes?cursor={deep}', owner),
+            '/notes/shared': ('/notes/shared', reader),
+        }
+        for name, (url, credentials) in cases.items():
+            p50, p99 = percentiles(client, url, credentials)
+            print(f'{count:>7} {name:<30} {p50:>8.2f} {p99:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
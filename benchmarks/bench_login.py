@@ -0,0 +1,47 @@
+"""Measure POST /login throughput at several PBKDF2 work factors.
+
+Logins per core is logins divided by the CPU time the process spent, so it does not depend on
+how many cores the hashing pool can use.
+
+Usage: python benchmarks/bench_login.py [seconds per setting] [iterations ...]
+"""
+import sys
+import time
+
+from common import setup
+
+setup('bench_login.db')
+
+from main import app, db, User, init_db  # noqa: E402
+from passwords import hash_password  # noqa: E402
+
+DEFAULT_ITERATIONS = (1000, 10000, 100000, 260000, 600000)
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    settings = [int(value) for value in sys.argv[2:]] or DEFAULT_ITERATIONS
+    client = app.test_client()
+    with app.app_context():
+        init_db()
+        # One user per setting, already hashed at that cost so no login triggers a rehash
+        db.session.add_all([User(username=f'user{iterations}', email=f'user{iterations}@example.com',
+                                 password=hash_password('bench_password', iterations)) for iterations in settings])
+        db.session.commit()
+
+    print(f'{"iterations":>10} {"ms/login":>9} {"logins/s":>9} {"logins/s/core":>14}')
+    for iterations in settings:
+        app.config['PASSWORD_HASH_ITERATIONS'] = iterations
+        credentials = {'username': f'user{iterations}', 'password': 'bench_password'}
+        count = 0
+        start, cpu_start = time.perf_counter(), time.process_time()
+        while time.perf_counter() - start < duration:
+            response = client.post('/login', json=credentials)
+            assert response.status_code == 200, response.data
+            count += 1
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        print(f'{iterations:>10} {elapsed / count * 1000:>9.2f} {count / elapsed:>9.0f} {count / cpu:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Measure the per-request overhead of metrics collection and the sampling profiler.
+
+Usage: python benchmarks/bench_metrics.py [requests]
+"""
+import sys
+import time
+
+from common import setup
+
+setup('bench_metrics.db')
+
+from main import app, db, User, Notes, init_db  # noqa: E402
+
+MODES = {
+    'metrics off': {'METRICS_ENABLED': False, 'PROFILER_ENABLED': False},
+    'metrics on': {'METRICS_ENABLED': True, 'PROFILER_ENABLED': False},
+    'metrics + profiler': {'METRICS_ENABLED': True, 'PROFILER_ENABLED': True},
+}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    client = app.test_client()
+    with app.app_context():
+        init_db()
+        user = User(username='bench', email='bench@example.com', password='pw')
+        db.session.add(user)
+        db.session.commit()
+        note = Notes(user_id=user.userid, post_content='Benchmark note')
+        db.session.add(note)
+        db.session.commit()
+        note_id = note.note_id
+    token = client.post('/login', json={'username': 'bench', 'password': 'pw'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # Interleave the modes over several rounds so drift affects them all equally
+    totals = dict.fromkeys(MODES, 0.0)
+    for _ in range(5):
+        for mode, settings in MODES.items():
+            app.config.update(settings)
+            start = time.perf_counter()
+            for _ in range(count // 5):
+                client.get(f'/notes/{note_id}', headers=headers)
+            totals[mode] += time.perf_counter() - start
+
+    baseline = totals['metrics off'] / count * 1e6
+    print(f'{"mode":<20} {"us/request":>11} {"overhead us":>12}')
+    for mode, total in totals.items():
+        per_request = total / count * 1e6
+        print(f'{mode:<20} {per_request:>11.1f} {per_request - baseline:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
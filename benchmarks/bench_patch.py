@@ -0,0 +1,96 @@
+"""Compare saving small edits to large notes with PUT (full content) and PATCH (edits or a unified diff).
+
+Each save inserts a few characters at a random position, like a keystroke-driven autosave. Reported per save:
+request body size, bytes written to the version history, and server latency.
+
+Usage: python benchmarks/bench_patch.py [--sizes 10000,100000,1000000] [--saves 100]
+"""
+import argparse
+import json
+import random
+import time
+
+from common import setup
+
+setup('bench_patch.db')
+
+from main import app, db, User, NoteVersionHistory, init_db  # noqa: E402
+
+
+def make_note(size, rng):
+    words = ['note', 'text', 'lorem', 'ipsum', 'dolor', 'sit', 'amet', 'edit']
+    lines = []
+    length = 0
+    while length < size:
+        line = ' '.join(rng.choice(words) for _ in range(rng.randint(4, 14))) + '\n'
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)
+
+
+# The request body for one save in the given mode, and the content after it
+def save_request(mode, content, rng):
+    position = rng.randint(0, len(content))
+    text = ''.join(rng.choice('abcdefgh ') for _ in range(rng.randint(1, 10)))
+    new_content = content[:position] + text + content[position:]
+    if mode == 'PUT full content':
+        return {'content': new_content}, new_content
+    if mode == 'PATCH edits':
+        return {'edits': [{'start': position, 'end': position, 'text': text}]}, new_content
+    # A one-line hunk for the line the insertion lands in
+    line_start = content.rfind('\n', 0, position) + 1
+    line_end = content.find('\n', position) + 1 or len(content)
+    line_number = content.count('\n', 0, line_start) + 1
+    old_line = content[line_start:line_end]
+    new_line = old_line[:position - line_start] + text + old_line[position - line_start:]
+    patch = f'--- a\n+++ b\n@@ -{line_number},1 +{line_number},1 @@\n-{old_line}+{new_line}'
+    return {'patch': patch}, new_content
+
+
+def history_bytes(note_id):
+    return db.session.query(db.func.coalesce(db.func.sum(db.func.length(NoteVersionHistory.content)), 0)).filter(
+        NoteVersionHistory.note_id == note_id).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--saves', type=int, default=100)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    with app.app_context():
+        init_db()
+        db.session.add(User(username='bench', email='bench@example.com', password='pw'))
+        db.session.commit()
+    token = client.post('/login', json={'username': 'bench', 'password': 'pw'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    print(f'{"note size":>10} {"mode":<18} {"request B":>10} {"history B":>10} {"ms/save":>8}')
+    for size in [int(value) for value in args.sizes.split(',')]:
+        for mode in ('PUT full content', 'PATCH edits', 'PATCH unified diff'):
+            rng = random.Random(size)
+            content = make_note(size, rng)
+            note_id = client.post('/notes/create', json={'content': content}, headers=headers).get_json()['note_id']
+            with app.app_context():
+                history_before = history_bytes(note_id)
+            request_bytes = 0
+            elapsed = 0.0
+            for _ in range(args.saves):
+                body, content = save_request(mode, content, rng)
+                data = json.dumps(body)
+                request_bytes += len(data.encode())
+                method = client.put if mode.startswith('PUT') else client.patch
+                start = time.perf_counter()
+                response = method(f'/notes/{note_id}', data=data, content_type='application/json', headers=headers)
+                elapsed += time.perf_counter() - start
+                assert response.status_code == 200, response.data
+            with app.app_context():
+                written = history_bytes(note_id) - history_before
+            assert client.get(f'/notes/{note_id}', headers=headers).get_json()['content'] == content
+            print(f'{size:>10} {mode:<18} {request_bytes / args.saves:>10.0f} {written / args.saves:>10.0f} '
+                  f'{elapsed / args.saves * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Measure how share checks and history queries scale with table size, before and after the indexes.
+
+Usage: python benchmarks/bench_schema.py [rows ...]   (default: 10000 100000 1000000)
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import setup
+
+setup('bench_schema.db')
+
+from main import app, db, User, Notes, NoteVersionHistory, NotesShared, migrate_schema, note_cache  # noqa: E402
+
+USERS = 1000
+REQUESTS = 200
+
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=db.engine)
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'userid': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'pw'}
+        for i in range(1, USERS + 1)])
+    db.session.execute(Notes.__table__.insert(), [
+        {'note_id': i, 'user_id': i % USERS + 1, 'post_content': f'note {i}', 'last_modified': now,
+         'modified_date': now} for i in range(1, rows + 1)])
+    db.session.execute(NoteVersionHistory.__table__.insert(), [
+        {'note_id': i % rows + 1, 'content': f'version {i}', 'modified_date': now + timedelta(seconds=i)}
+        for i in range(rows)])
+    # Share every note with the next user along, so user 1 sees the notes owned by user 1000
+    db.session.execute(NotesShared.__table__.insert(), [
+        {'note_id': i, 'author_id': i % USERS + 1, 'shared_with_user_id': (i + 1) % USERS + 1}
+        for i in range(1, rows + 1)])
+    db.session.commit()
+
+
+def latency_ms(client, url, credentials):
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        # Measure the database lookups rather than the note cache
+        note_cache.clear()
+        response = client.get(url, json=credentials)
+        # Read the whole body, since the history endpoint streams it
+        response.get_data()
+        assert response.status_code == 200, response.data
+    return (time.perf_counter() - start) / REQUESTS * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    client = app.test_client()
+    # Notes with ids divisible by USERS belong to user1 and are shared with user2
+    credentials = {'username': 'user2', 'password': 'pw'}
+    print(f'{"rows":>9} {"indexes":>8} {"GET note (shared) ms":>21} {"GET history ms":>15}')
+    for rows in sizes:
+        with app.app_context():
+            seed(rows)
+            note_id = rows - rows % USERS
+            for label in ('no', 'yes'):
+                if label == 'yes':
+                    migrate_schema()
+                note_ms = latency_ms(client, f'/notes/{note_id}', credentials)
+                history_ms = latency_ms(client, f'/notes/version-history/{note_id}', credentials)
+                print(f'{rows:>9} {label:>8} {note_ms:>21.3f} {history_ms:>15.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Measure full-text search latency against corpus size.
+
+Usage: python benchmarks/bench_search.py [notes ...]   (default: 10000 100000 1000000)
+"""
+import itertools
+import random
+import sys
+import time
+from datetime import datetime
+
+from common import setup
+
+setup('bench_search.db')
+
+from main import app, db, User, Notes, NotesShared, init_db  # noqa: E402
+
+USERS = 100
+WORDS_PER_NOTE = 40
+REQUESTS = 200
+# Zipf-like vocabulary so some words are common and others rare
+VOCABULARY = [f'word{i}' for i in range(20000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY))))
+QUERIES = {'common': 'word1', 'medium': 'word500', 'rare': 'word15000', 'two words': 'word3 word40'}
+
+
+def seed(count):
+    db.drop_all()
+    init_db()
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'userid': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'pw'}
+        for i in range(1, USERS + 1)])
+    for start in range(0, count, 50000):
+        db.session.execute(Notes.__table__.insert(), [
+            {'note_id': i, 'user_id': i % USERS + 1, 'last_modified': now, 'modified_date': now,
+             'post_content': ' '.join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=WORDS_PER_NOTE))}
+            for i in range(start + 1, min(start + 50000, count) + 1)])
+    # Share a tenth of the corpus with user 1 as well
+    db.session.execute(NotesShared.__table__.insert(), [
+        {'note_id': i, 'author_id': i % USERS + 1, 'shared_with_user_id': 1}
+        for i in range(1, count + 1, 10) if i % USERS != 0])
+    db.session.commit()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    client = app.test_client()
+    credentials = {'username': 'user1', 'password': 'pw'}
+    print(f'{"notes":>9} ' + ' '.join(f'{name + " ms":>14}' for name in QUERIES))
+    for count in sizes:
+        with app.app_context():
+            seed(count)
+        timings = []
+        for query in QUERIES.values():
+            start = time.perf_counter()
+            for _ in range(REQUESTS):
+                response = client.get(f'/notes/search?q={query}', json=credentials)
+                assert response.status_code == 200, response.data
+            timings.append((time.perf_counter() - start) / REQUESTS * 1000)
+        print(f'{count:>9} ' + ' '.join(f'{timing:>14.3f}' for timing in timings))
+
+
+if __name__ == '__main__':
+    main()
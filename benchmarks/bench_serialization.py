@@ -0,0 +1,101 @@
+"""Measure peak RSS and time-to-first-byte for a 10 MB note and a 10k-version history.
+
+Each scenario runs in a fresh process against the same seeded database, so the RSS growth
+reported is what serving that one response cost.
+
+Usage: python benchmarks/bench_serialization.py [--note-mb 10] [--versions 10000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import ROOT, current_rss, disable_rate_limits, peak_rss, reset_peak_rss, temp_database_url
+
+disable_rate_limits()
+SCENARIOS = {
+    'note, buffered': ('note', {'STREAM_THRESHOLD': float('inf')}, True),
+    'note, streamed': ('note', {}, True),
+    'note, streamed, stdlib json': ('note', {}, False),
+    'history, streamed': ('history', {}, True),
+    'history, streamed, stdlib json': ('history', {}, False),
+}
+
+
+def seed(args):
+    sys.path.insert(0, ROOT)
+    from main import app, db, User, Notes, NoteVersionHistory, init_db
+    with app.app_context():
+        init_db()
+        user = User(username='bench', email='bench@example.com', password='pw')
+        db.session.add(user)
+        db.session.commit()
+        big_note = Notes(user_id=user.userid, post_content='Lorem ipsum "dolor" sit amet\n' * (args.note_mb * 37450))
+        history_note = Notes(user_id=user.userid, post_content='x')
+        db.session.add_all([big_note, history_note])
+        db.session.commit()
+        start = datetime.utcnow()
+        db.session.execute(NoteVersionHistory.__table__.insert(), [
+            {'note_id': history_note.note_id, 'content': f'Version {i}\n' + 'y' * 1000,
+             'modified_date': start + timedelta(seconds=i), 'is_delta': False} for i in range(args.versions)])
+        db.session.commit()
+        return big_note.note_id, history_note.note_id
+
+
+# Serve one scenario and print its measurements as JSON
+def measure(args):
+    sys.path.insert(0, ROOT)
+    import serialization
+    from main import app
+    kind, settings, use_orjson = SCENARIOS[args.measure]
+    app.config.update(settings)
+    if not use_orjson:
+        serialization.orjson = None
+    client = app.test_client()
+    credentials = {'username': 'bench', 'password': 'pw'}
+    url = f'/notes/{args.note_id}' if kind == 'note' else f'/notes/version-history/{args.note_id}'
+    # Warm up imports, the connection pool and the user lookup on a tiny request
+    client.get('/notes/0', json=credentials)
+
+    reset_peak_rss()
+    rss_before = current_rss()
+    start = time.perf_counter()
+    response = client.get(url, json=credentials, buffered=False)
+    body = iter(response.response)
+    size = len(next(body))
+    first_byte = time.perf_counter() - start
+    for chunk in body:
+        size += len(chunk)
+    total = time.perf_counter() - start
+    peak = peak_rss()
+    print(json.dumps({'ttfb_ms': first_byte * 1000, 'total_ms': total * 1000, 'bytes': size,
+                      'peak_rss_growth_mb': max(0, peak - rss_before) / 2 ** 20}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--note-mb', type=int, default=10)
+    parser.add_argument('--versions', type=int, default=10000)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--note-id', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        return measure(args)
+
+    os.environ['DATABASE_URL'] = temp_database_url('bench_serialization.db')
+    big_note_id, history_note_id = seed(args)
+    print(f'{"scenario":<32} {"TTFB ms":>9} {"total ms":>9} {"MB sent":>8} {"peak RSS +MB":>13}')
+    for name, (kind, _, _) in SCENARIOS.items():
+        note_id = big_note_id if kind == 'note' else history_note_id
+        output = subprocess.run([sys.executable, __file__, '--measure', name, '--note-id', str(note_id)],
+                                env=os.environ, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f'{name:<32} {result["ttfb_ms"]:>9.1f} {result["total_ms"]:>9.1f} {result["bytes"] / 2 ** 20:>8.1f} '
+              f'{result["peak_rss_growth_mb"]:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Compare throughput under many concurrent connections for the Flask dev server, gunicorn WSGI and gunicorn ASGI.
+
+Every connection is a keep-alive HTTP/1.1 client sending requests back to back (mostly GET /notes/<id>,
+some PUTs). Each server mode runs with the same number of worker processes against the same database.
+
+Usage: python benchmarks/bench_server.py [--connections 50,200,1000] [--duration 10] [--workers 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from common import ROOT, disable_rate_limits, percentile, temp_database_url
+
+disable_rate_limits()
+MODES = {
+    'flask dev server': ([sys.executable, 'main.py'], {}),
+    'gunicorn wsgi': ([sys.executable, '-m', 'gunicorn'], {'SERVER_MODE': 'wsgi'}),
+    'gunicorn asgi': ([sys.executable, '-m', 'gunicorn'], {'SERVER_MODE': 'asgi'}),
+}
+
+
+def seed(notes):
+    sys.path.insert(0, ROOT)
+    from main import app, db, User, Notes, init_db
+    with app.app_context():
+        init_db()
+        user = User(username='bench', email='bench@example.com', password='pw')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add_all([Notes(user_id=user.userid, post_content=f'Note {i}') for i in range(notes)])
+        db.session.commit()
+        return [note_id for note_id, in db.session.query(Notes.note_id)]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:] if line)
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    keep_alive = lines[0].startswith('HTTP/1.1') and headers.get('connection') != 'close'
+    return status, body, keep_alive
+
+
+# One keep-alive connection sending requests until the deadline, reconnecting if the server closes it
+async def connection(port, token, note_ids, write_ratio, deadline, results, seed_value):
+    rng = random.Random(seed_value)
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        note_id = rng.choice(note_ids)
+        if rng.random() < write_ratio:
+            body = json.dumps({'content': f'edit {rng.random()}'}).encode()
+            method = 'PUT'
+        else:
+            body, method = b'', 'GET'
+        request = (f'{method} /notes/{note_id} HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {token}\r\n'
+                   f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n').encode() + body
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            status, _, keep_alive = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError):
+            status, keep_alive = 599, False
+        results.append((time.perf_counter() - start, status))
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port, token, note_ids, connections, args):
+    results = []
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(*(connection(port, token, note_ids, args.write_ratio, deadline, results, index)
+                           for index in range(connections)))
+    return results, time.perf_counter() - start
+
+
+def login(port):
+    request = json.dumps({'username': 'bench', 'password': 'pw'}).encode()
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(b'POST /login HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     b'Connection: close\r\nContent-Length: ' + str(len(request)).encode() + b'\r\n\r\n' + request)
+        response = b''
+        while chunk := sock.recv(65536):
+            response += chunk
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])['token']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', default='50,200,1000')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--notes', type=int, default=1000)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    database_url = temp_database_url('bench_server.db')
+    os.environ['DATABASE_URL'] = database_url
+    note_ids = seed(args.notes)
+    print(f'{args.workers} worker processes (the dev server is a single process), {args.duration:g}s per run, '
+          f'{args.write_ratio:.0%} writes')
+    print(f'{"mode":<18} {"conns":>6} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>9} {"errors":>7}')
+    for mode, (command, settings) in MODES.items():
+        port = 5100 + list(MODES).index(mode)
+        env = dict(os.environ, DATABASE_URL=database_url, PORT=str(port), WEB_CONCURRENCY=str(args.workers),
+                   **settings)
+        server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            token = login(port)
+            for connections in [int(value) for value in args.connections.split(',')]:
+                results, elapsed = asyncio.run(run_load(port, token, note_ids, connections, args))
+                latencies = [latency * 1000 for latency, status in results if status < 500]
+                errors = sum(1 for _, status in results if status >= 500)
+                print(f'{mode:<18} {connections:>6} {len(latencies) / elapsed:>8.0f} '
+                      f'{percentile(latencies, 0.50):>8.1f} {percentile(latencies, 0.99):>9.1f} {errors:>7}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
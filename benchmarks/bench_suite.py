@@ -0,0 +1,338 @@
+"""Seed a synthetic dataset, drive every route with a weighted request mix, and report latency and throughput.
+
+Seeding writes --users users, each with --notes notes of --versions versions, and shares every note with
+--shares other users, using bulk inserts. Then --clients threads each send --requests requests, picking routes
+by the weights of --mix (read, balanced or write) with fixed random seeds, so two runs send the same requests.
+
+The results (count, errors and p50/p95/p99 milliseconds per route, and overall throughput) are printed as JSON,
+or written to --output. --save-baseline FILE also stores them as a baseline. --baseline FILE compares the run
+with a stored one and exits with status 1 if the throughput, the overall p95, the p95 of a route with at
+least MIN_SAMPLES requests, or a route's error count is worse by more than --tolerance. Baselines only compare
+runs on the same machine with the same settings.
+
+Usage: python benchmarks/bench_suite.py [--users 100] [--notes 50] [--versions 20] [--shares 1] [--clients 4]
+       [--requests 2000] [--mix balanced] [--output FILE] [--baseline FILE] [--save-baseline FILE]
+       [--tolerance 0.5]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common import percentile, setup
+
+setup('bench_suite.db')
+# Keep logins and signups cheap; the production work factor is measured by bench_login.py
+os.environ.setdefault('PASSWORD_HASH_ITERATIONS', '1000')
+# Export and import run a query per page or note by design
+os.environ.setdefault('QUERY_COUNT_WARNING', '1000000')
+
+from main import app, db, User, Notes, NoteVersionHistory, NotesShared, init_db  # noqa: E402
+from passwords import hash_password  # noqa: E402
+
+WORDS = [f'word{i}' for i in range(2000)]
+# Relative weight of each operation per mix; every route is in every mix
+MIXES = {
+    'read': {'get': 35, 'list': 12, 'list_shared': 5, 'search': 10, 'history': 8, 'batch_get': 6, 'update': 6,
+             'patch': 4, 'create': 3, 'batch_create': 1, 'batch_update': 1, 'share': 1, 'unshare': 1, 'login': 2,
+             'signup': 0.5, 'create_group': 0.25, 'set_group_members': 0.25, 'export': 0.2, 'import': 0.2,
+             'metrics': 0.5},
+    'balanced': {'get': 20, 'list': 8, 'list_shared': 3, 'search': 6, 'history': 6, 'batch_get': 4, 'update': 18,
+                 'patch': 12, 'create': 8, 'batch_create': 2, 'batch_update': 3, 'share': 2, 'unshare': 2,
+                 'login': 2, 'signup': 1, 'create_group': 0.5, 'set_group_members': 0.5, 'export': 0.2,
+                 'import': 0.2, 'metrics': 0.5},
+    'write': {'get': 8, 'list': 3, 'list_shared': 1, 'search': 2, 'history': 2, 'batch_get': 2, 'update': 30,
+              'patch': 20, 'create': 15, 'batch_create': 4, 'batch_update': 6, 'share': 3, 'unshare': 3,
+              'login': 2, 'signup': 1, 'create_group': 0.5, 'set_group_members': 0.5, 'export': 0.2,
+              'import': 0.2, 'metrics': 0.5},
+}
+# Latency differences below this many milliseconds are noise, whatever the tolerance
+MIN_REGRESSION_MS = 1.0
+# A route's p95 over fewer requests than this varies too much between runs to compare, so such routes are
+# only checked for errors
+MIN_SAMPLES = 200
+
+
+def text(rng, words):
+    return ' '.join(rng.choices(WORDS, k=words))
+
+
+# Write the dataset with bulk inserts and return the note ids each user owns and can read
+def seed(args):
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    password = hash_password('pw', app.config['PASSWORD_HASH_ITERATIONS'])
+    owned = {user_id: [] for user_id in range(1, args.users + 1)}
+    shared = {user_id: [] for user_id in owned}
+    with app.app_context():
+        init_db()
+        db.session.execute(User.__table__.insert(), [
+            {'userid': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+             'password': password} for user_id in owned])
+        note_id = 0
+        for user_id in owned:
+            notes, versions, shares = [], [], []
+            for _ in range(args.notes):
+                note_id += 1
+                owned[user_id].append(note_id)
+                modified = now - timedelta(minutes=rng.randrange(60 * 24 * 90))
+                notes.append({'note_id': note_id, 'user_id': user_id, 'post_content': text(rng, 60),
+                              'last_modified': modified, 'modified_date': modified - timedelta(days=1),
+                              'version': args.versions})
+                versions.extend({'note_id': note_id, 'content': text(rng, 60), 'is_delta': False,
+                                 'modified_date': modified - timedelta(hours=args.versions - i)}
+                                for i in range(args.versions))
+                others = [other for other in owned if other != user_id]
+                for recipient in rng.sample(others, min(args.shares, len(others))):
+                    shared[recipient].append(note_id)
+                    shares.append({'note_id': note_id, 'author_id': user_id, 'shared_with_user_id': recipient,
+                                   'note_last_modified': modified})
+            db.session.execute(Notes.__table__.insert(), notes)
+            if versions:
+                db.session.execute(NoteVersionHistory.__table__.insert(), versions)
+            if shares:
+                db.session.execute(NotesShared.__table__.insert(), shares)
+            db.session.commit()
+    return owned, shared
+
+
+# The request for each operation, as (method, url, json body or raw data); None skips the operation
+class Requests:
+    def __init__(self, client_index, user_id, owned, shared, users, rng):
+        self.client_index = client_index
+        self.user_id = user_id
+        self.owned = owned
+        self.shared = shared
+        self.users = users
+        self.rng = rng
+        self.counter = 0
+        self.group_id = None
+        now = datetime.utcnow().isoformat()
+        self.archive = '\n'.join(json.dumps(record) for record in [
+            {'type': 'export', 'format_version': 1},
+            {'type': 'note', 'note_id': 1, 'content': 'Imported note', 'last_modified': now, 'modified_date': now},
+            {'type': 'version', 'note_id': 1, 'version_id': 1, 'content': 'Imported note', 'modified_date': now},
+        ]).encode() + b'\n'
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f'{prefix}-{self.client_index}-{self.counter}'
+
+    def readable_note(self):
+        if self.shared[self.user_id] and self.rng.random() < 0.2:
+            return self.rng.choice(self.shared[self.user_id])
+        return self.rng.choice(self.owned[self.user_id])
+
+    def other_users(self, count):
+        return self.rng.sample([user_id for user_id in range(1, self.users + 1) if user_id != self.user_id],
+                               min(count, self.users - 1))
+
+    def get(self):
+        return 'GET', f'/notes/{self.readable_note()}', None
+
+    def list(self):
+        return 'GET', '/notes?limit=20', None
+
+    def list_shared(self):
+        return 'GET', '/notes/shared?limit=20', None
+
+    def search(self):
+        return 'GET', f'/notes/search?q={self.rng.choice(WORDS)}', None
+
+    def history(self):
+        return 'GET', f'/notes/version-history/{self.readable_note()}?limit=20', None
+
+    def batch_get(self):
+        return 'GET', '/notes/batch', {'note_ids': self.rng.sample(self.owned[self.user_id],
+                                                                   min(10, len(self.owned[self.user_id])))}
+
+    def update(self):
+        return 'PUT', f'/notes/{self.rng.choice(self.owned[self.user_id])}', {'content': text(self.rng, 60)}
+
+    def patch(self):
+        return 'PATCH', f'/notes/{self.rng.choice(self.owned[self.user_id])}', {
+            'edits': [{'start': 0, 'end': 0, 'text': self.rng.choice(WORDS) + ' '}]}
+
+    def create(self):
+        return 'POST', '/notes/create', {'content': text(self.rng, 60)}
+
+    def batch_create(self):
+        return 'POST', '/notes/batch', {'notes': [{'content': text(self.rng, 60)} for _ in range(10)]}
+
+    def batch_update(self):
+        note_ids = self.rng.sample(self.owned[self.user_id], min(10, len(self.owned[self.user_id])))
+        return 'PUT', '/notes/batch', {'notes': [{'note_id': note_id, 'content': text(self.rng, 60)}
+                                                 for note_id in note_ids]}
+
+    def share(self):
+        return 'POST', '/notes/share', {'note_id': self.rng.choice(self.owned[self.user_id]),
+                                        'shared_with_user_ids': self.other_users(3)}
+
+    def unshare(self):
+        return 'POST', '/notes/unshare', {'note_id': self.rng.choice(self.owned[self.user_id]),
+                                          'shared_with_user_ids': self.other_users(3)}
+
+    def login(self):
+        return 'POST', '/login', {'username': f'user{self.user_id}', 'password': 'pw'}
+
+    def signup(self):
+        username = self.unique('signup')
+        return 'POST', '/signup', {'username': username, 'email': f'{username}@example.com', 'password': 'pw'}
+
+    def create_group(self):
+        return 'POST', '/groups', {'name': self.unique('group'), 'member_ids': self.other_users(5)}
+
+    def set_group_members(self):
+        if self.group_id is None:
+            return None
+        return 'PUT', f'/groups/{self.group_id}/members', {'member_ids': self.other_users(5)}
+
+    def export(self):
+        return 'GET', '/notes/export?format=gzip', None
+
+    def import_(self):
+        return 'POST', '/notes/import', self.archive
+
+    def metrics(self):
+        return 'GET', '/metrics', None
+
+
+def run_client(client_index, user_id, owned, shared, args, latencies, errors):
+    rng = random.Random(1000 + client_index)
+    client = app.test_client()
+    token = client.post('/login', json={'username': f'user{user_id}', 'password': 'pw'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    requests = Requests(client_index, user_id, owned, shared, args.users, rng)
+    response = client.post('/groups', json={'name': requests.unique('group')}, headers=headers)
+    requests.group_id = response.get_json()['group_id']
+    mix = MIXES[args.mix]
+    operations, weights = list(mix), list(mix.values())
+    for _ in range(args.requests):
+        operation = rng.choices(operations, weights)[0]
+        built = getattr(requests, 'import_' if operation == 'import' else operation)()
+        if built is None:
+            continue
+        method, url, body = built
+        options = {'data': body} if isinstance(body, bytes) else {'json': body}
+        start = time.perf_counter()
+        response = client.open(url, method=method, headers=headers, **options)
+        # Drain streamed responses so their full cost is measured
+        response.get_data()
+        latencies[operation].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors[operation] += 1
+        if operation == 'create' and response.status_code == 201:
+            owned[user_id].append(response.get_json()['note_id'])
+
+
+def summarize(values, count_errors, elapsed):
+    return {'count': len(values), 'errors': count_errors, 'throughput': len(values) / elapsed,
+            'p50_ms': percentile(values, 0.5) * 1000, 'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000}
+
+
+def run(args):
+    owned, shared = seed(args)
+    mix = MIXES[args.mix]
+    latencies = {operation: [] for operation in mix}
+    errors = dict.fromkeys(mix, 0)
+    # Each client acts as a different user, so their writes do not contend for the same notes
+    threads = [threading.Thread(target=run_client, args=(index, index % args.users + 1, owned, shared, args,
+                                                         latencies, errors))
+               for index in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    settings = {key: getattr(args, key) for key in ('users', 'notes', 'versions', 'shares', 'clients',
+                                                    'requests', 'mix')}
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {'settings': settings, 'seconds': elapsed,
+            'overall': summarize(all_latencies, sum(errors.values()), elapsed),
+            'routes': {operation: summarize(latencies[operation], errors[operation], elapsed)
+                       for operation in mix}}
+
+
+# Return a message for each way the results are worse than the baseline by more than the tolerance
+def regressions(results, baseline, tolerance):
+    found = []
+    if results['overall']['throughput'] < baseline['overall']['throughput'] * (1 - tolerance):
+        found.append(f'throughput {results["overall"]["throughput"]:.0f}/s, baseline '
+                     f'{baseline["overall"]["throughput"]:.0f}/s')
+    for operation, expected in [('overall', baseline['overall'])] + list(baseline['routes'].items()):
+        actual = results['overall'] if operation == 'overall' else results['routes'].get(operation)
+        if actual is None:
+            found.append(f'{operation}: missing from the results')
+            continue
+        if (expected['count'] >= MIN_SAMPLES and actual['p95_ms'] > expected['p95_ms'] * (1 + tolerance)
+                and actual['p95_ms'] - expected['p95_ms'] > MIN_REGRESSION_MS):
+            found.append(f'{operation}: p95 {actual["p95_ms"]:.1f} ms, baseline {expected["p95_ms"]:.1f} ms')
+        if operation != 'overall' and actual['errors'] > expected['errors']:
+            found.append(f'{operation}: {actual["errors"]} errors, baseline {expected["errors"]}')
+    return found
+
+
+def print_table(results):
+    print(f'{"route":<18} {"count":>6} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}', file=sys.stderr)
+    for operation, route in list(results['routes'].items()) + [('overall', results['overall'])]:
+        print(f'{operation:<18} {route["count"]:>6} {route["errors"]:>6} {route["p50_ms"]:>8.2f} '
+              f'{route["p95_ms"]:>8.2f} {route["p99_ms"]:>8.2f}', file=sys.stderr)
+    print(f'{results["overall"]["count"]} requests in {results["seconds"]:.1f}s, '
+          f'{results["overall"]["throughput"]:.0f} requests/s', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--notes', type=int, default=50, help='notes per user')
+    parser.add_argument('--versions', type=int, default=20, help='versions per note')
+    parser.add_argument('--shares', type=int, default=1, help='users each note is shared with')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per client')
+    parser.add_argument('--mix', choices=MIXES, default='balanced')
+    parser.add_argument('--output', help='write the JSON results here instead of standard output')
+    parser.add_argument('--baseline', help='fail if the results are worse than this stored run')
+    parser.add_argument('--save-baseline', help='store the results here as a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown, as a fraction')
+    args = parser.parse_args()
+    if args.users < 2 or args.notes < 1:
+        parser.error('--users must be at least 2 and --notes at least 1')
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        settings = {key: getattr(args, key) for key in baseline['settings']}
+        if settings != baseline['settings']:
+            parser.error(f'the baseline was recorded with {baseline["settings"]}')
+
+    results = run(args)
+    print_table(results)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            baseline_file.write(output + '\n')
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.tolerance)
+        for message in found:
+            print(f'REGRESSION {message}', file=sys.stderr)
+        if found:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline} (tolerance {args.tolerance:.0%})', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
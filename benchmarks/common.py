@@ -0,0 +1,58 @@
+"""Setup and helpers shared by the benchmark scripts.
+
+Scripts that import the app in their own process call setup() before importing main. Scripts that start the app
+in child processes use ROOT, temp_database_url() and disable_rate_limits() to prepare them instead.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# URL of a new SQLite database file called `name` in a fresh temporary directory
+def temp_database_url(name):
+    return f'sqlite:///{os.path.join(tempfile.mkdtemp(), name)}'
+
+
+# One benchmark client sends far more requests than the per-client rate limits allow, so they are off unless
+# RATE_LIMIT_ENABLED is set
+def disable_rate_limits():
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+
+# Point this process at a new temporary database and make the repository importable. Call it before importing
+# main, whose engine is created on import; returns the database file's path.
+def setup(name):
+    url = temp_database_url(name)
+    os.environ['DATABASE_URL'] = url
+    disable_rate_limits()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return url[len('sqlite:///'):]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def current_rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+# Peak RSS of this process (Linux VmHWM); unlike ru_maxrss it is not inherited from the parent
+def peak_rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
@@ -0,0 +1,122 @@
+"""Concurrency load test: N parallel clients sending mixed reads and writes to a live server.
+
+Runs once with SQLite's defaults (rollback journal, synchronous=FULL, default pool) and once
+with the configured engine settings (WAL, synchronous=NORMAL, larger pool), then compares them.
+
+Usage: python benchmarks/load_test.py [--clients 16] [--duration 10] [--read-ratio 0.8]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from common import ROOT, percentile, temp_database_url
+
+MODES = {
+    'before': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'DB_POOL_SIZE': '5',
+               'DB_MAX_OVERFLOW': '10'},
+    'after': {},
+}
+
+
+def call(base_url, method, path, body=None, token=None):
+    request = urllib.request.Request(base_url + path, method=method, data=json.dumps(body or {}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    if token:
+        request.add_header('Authorization', f'Bearer {token}')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as error:
+        return error.code, None
+
+
+def client(base_url, user, note_ids, args, deadline, results):
+    rng = random.Random(user)
+    _, data = call(base_url, 'POST', '/login', {'username': user, 'password': 'pw'})
+    token = data['token']
+    while time.perf_counter() < deadline:
+        note_id = rng.choice(note_ids)
+        start = time.perf_counter()
+        if rng.random() < args.read_ratio:
+            status, _ = call(base_url, 'GET', f'/notes/{note_id}', token=token)
+        else:
+            status, _ = call(base_url, 'PUT', f'/notes/{note_id}', {'content': f'edit {rng.random()}'}, token)
+        results.append((time.perf_counter() - start, status))
+
+
+# Run one mode against a fresh database and print its results as JSON
+def worker(args):
+    from werkzeug.serving import make_server
+    sys.path.insert(0, ROOT)
+    from main import app, db, User, Notes, init_db
+
+    with app.app_context():
+        init_db()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com', password='pw') for i in range(args.clients)]
+        db.session.add_all(users)
+        db.session.commit()
+        notes = {user.username: [Notes(user_id=user.userid, post_content='seed') for _ in range(10)] for user in users}
+        db.session.add_all([note for user_notes in notes.values() for note in user_notes])
+        db.session.commit()
+        note_ids = {username: [note.note_id for note in user_notes] for username, user_notes in notes.items()}
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    results = []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=client, args=(base_url, username, ids, args, deadline, results))
+               for username, ids in note_ids.items()]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    latencies = [latency * 1000 for latency, _ in results]
+    print(json.dumps({
+        'requests': len(results),
+        'errors': sum(1 for _, status in results if status >= 500),
+        'throughput': len(results) / elapsed,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args)
+
+    print(f'{args.clients} clients, {args.duration:g}s, {args.read_ratio:.0%} reads')
+    print(f'{"mode":>7} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for mode, settings in MODES.items():
+        # Each mode runs in its own process, since engine settings are read when main is imported
+        # All clients share one address, so the per-client rate limits are off
+        env = dict(os.environ, DATABASE_URL=temp_database_url('load.db'),
+                   RATE_LIMIT_ENABLED='0', **settings)
+        output = subprocess.run([sys.executable, __file__, '--worker'] + sys.argv[1:], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f'{mode:>7} {result["throughput"]:>9.0f} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} '
+              f'{result["p99_ms"]:>8.2f} {result["errors"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Interface shared by cache backends, so a shared cache (e.g. Redis) can stand in for the local one.
+# Values must be plain JSON-compatible data so any backend can store them.
+class CacheBackend:
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# Thread-safe LRU cache where every entry also expires after a time-to-live. With maxbytes set, sizeof(value)
+# estimates each entry's memory and the least recently used entries are evicted to keep the total under maxbytes;
+# a value larger than maxbytes on its own is not stored.
+class TTLCache(CacheBackend):
+    def __init__(self, maxsize=1024, ttl=60, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                return default
+            # Mark the entry as most recently used
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            self._pop(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (value, time.monotonic() + ttl, size)
+            self._bytes += size
+            # Evict the least recently used entries once the cache is full
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self._bytes > self.maxbytes):
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    # Estimated memory held by the entries, as measured by sizeof (0 without maxbytes)
+    @property
+    def nbytes(self):
+        with self._lock:
+            return self._bytes
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,37 @@
+# Production launcher settings: `gunicorn` from the repository root reads this file.
+# SERVER_MODE=asgi serves asgi:application on uvicorn workers; wsgi (the default) serves main:app on threaded workers.
+import os
+
+server_mode = os.environ.get('SERVER_MODE', 'wsgi')
+bind = f'{os.environ.get("HOST", "127.0.0.1")}:{os.environ.get("PORT", 5000)}'
+# One worker by default: the note cache and rate-limit buckets live in process memory (see on_starting)
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Import the app once in the master and fork workers from it, so each worker starts without re-importing
+preload_app = True
+if server_mode == 'asgi':
+    wsgi_app = 'asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'main:app'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WSGI_THREADS', 16))
+
+
+# Migrate the database once in the master rather than in every worker
+def on_starting(server):
+    from caching import TTLCache
+    from main import app, db, init_db, note_cache
+    with app.app_context():
+        init_db()
+        db.engine.dispose()
+    # Each worker would keep its own copy of a note or access list and serve it for up to NOTE_CACHE_TTL after
+    # another worker changed it, so the in-process note cache is off unless it has been replaced by a shared one
+    if server.cfg.workers > 1 and isinstance(note_cache, TTLCache):
+        note_cache.ttl = 0
+
+
+# Pooled connections must not be shared across processes; each worker opens its own
+def post_fork(server, worker):
+    from main import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,157 @@
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Monotonic counter keyed by label values
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+
+# Cumulative histogram keyed by label values, rendered the way Prometheus expects
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        # Counts are stored per bucket and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(label_values, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[label_values] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                running += count
+                le = '+Inf' if bound == float('inf') else format_value(float(bound))
+                samples.append((f'{self.name}_bucket', format_labels(self.labels, key, f'le="{le}"'), running))
+            samples.append((f'{self.name}_sum', format_labels(self.labels, key), total))
+            samples.append((f'{self.name}_count', format_labels(self.labels, key), running))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, description, labels=()):
+        metric = Counter(name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, description, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {format_value(value)}' for name, labels, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Samples the call stacks of registered threads from one background thread,
+# so a request can be profiled without knowing in advance whether it will be slow
+class SamplingProfiler:
+    def __init__(self, interval=0.005, depth=30):
+        self.interval = interval
+        self.depth = depth
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = StackCounter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    # Stop sampling the current thread and return how often each stack was seen
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), StackCounter())
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self._stack(frame)] += 1
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.depth:
+            code = frame.f_code
+            stack.append(f'{code.co_filename}:{frame.f_lineno} {code.co_name}')
+            frame = frame.f_back
+        return tuple(stack)
+
+    @staticmethod
+    def format(stacks, limit=5):
+        total = sum(stacks.values())
+        lines = []
+        for stack, count in stacks.most_common(limit):
+            lines.append(f'{count}/{total} samples:')
+            lines.extend(f'    {line}' for line in stack)
+        return '\n'.join(lines)
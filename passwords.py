@@ -0,0 +1,38 @@
+import functools
+import hmac
+import secrets
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHODS = ('pbkdf2:', 'scrypt:')
+
+
+def hash_method(iterations):
+    return f'pbkdf2:sha256:{iterations}'
+
+
+def hash_password(password, iterations):
+    return generate_password_hash(password, method=hash_method(iterations))
+
+
+# Hash of a random password, verified against when a username is unknown so that a failed login takes as long
+# whether or not the user exists
+@functools.lru_cache(maxsize=None)
+def dummy_hash(iterations):
+    return hash_password(secrets.token_hex(16), iterations)
+
+
+# Stored values without a hash prefix are plaintext rows from before passwords were hashed
+def is_hashed(stored):
+    return stored.startswith(HASH_METHODS) and '$' in stored
+
+
+def verify_password(stored, password):
+    if is_hashed(stored):
+        return check_password_hash(stored, password)
+    return hmac.compare_digest(stored.encode(), password.encode())
+
+
+# True for plaintext rows and for hashes made with a different work factor than the configured one
+def needs_rehash(stored, iterations):
+    return not is_hashed(stored) or stored.split('$', 1)[0] != hash_method(iterations)
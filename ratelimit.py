@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Parse a '<requests per second>/<burst>' rate limit setting
+def parse_rate_limit(value):
+    rate, burst = value.split('/')
+    return float(rate), int(burst)
+
+
+# Interface shared by token bucket stores, so a shared store (e.g. Redis) can stand in for the local one and
+# enforce limits across worker processes.
+class BucketStore:
+    # Take one token from the bucket for `key`, which refills at `rate` (> 0) tokens per second up to `burst`.
+    # Returns 0 if a token was taken, otherwise the seconds until one will be available.
+    def take(self, key, rate, burst):
+        raise NotImplementedError
+
+    # Seconds until a token will be available in the bucket for `key`, or 0 if there is one; takes nothing
+    def wait_time(self, key, rate, burst):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# Thread-safe token buckets held in process memory. Past `maxsize` keys the least recently used bucket is
+# dropped; a client seen again starts with a full bucket, so keep maxsize above the number of active clients.
+class MemoryBucketStore(BucketStore):
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+                bucket = self._buckets[key] = [burst, now]
+                while len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                self._buckets.move_to_end(key)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def wait_time(self, key, rate, burst):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0
+            tokens = min(burst, bucket[0] + (time.monotonic() - bucket[1]) * rate)
+        return 0 if tokens >= 1 else (1 - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+# Caps how many requests a process handles at once. A request that finds every slot taken waits up to a
+# timeout for one, then is turned away. A limit of 0 disables the cap.
+class ConcurrencyLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit) if limit > 0 else None
+
+    def acquire(self, timeout):
+        return self._slots is None or self._slots.acquire(timeout=timeout)
+
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
@@ -0,0 +1,19 @@
+# Version history retention policy: which versions of a note a history compaction keeps
+from datetime import timedelta
+
+
+# Ids of the versions to keep, given (version_id, modified_date) pairs for one note. A version is kept if it is
+# one of the `keep_last` newest, or newer than `keep_days` days, or, when `daily` is set, the newest of the
+# older versions saved on its day. The newest version is always kept, since new deltas are based on it.
+def versions_to_keep(versions, now, keep_last, keep_days, daily):
+    newest_first = sorted(versions, key=lambda version: version[0], reverse=True)
+    keep = {version_id for version_id, _ in newest_first[:max(keep_last, 1)]}
+    cutoff = now - timedelta(days=keep_days)
+    days = set()
+    for version_id, modified_date in newest_first:
+        if modified_date >= cutoff:
+            keep.add(version_id)
+        elif daily and modified_date.date() not in days:
+            days.add(modified_date.date())
+            keep.add(version_id)
+    return keep
@@ -0,0 +1,123 @@
+import json
+import zlib
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Flask JSON provider that encodes with orjson when it is installed, producing the same values
+# as the default provider (sorted keys, HTTP dates), with non-ASCII text as UTF-8 rather than escapes
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        # jsonify passes compact separators, or indent=2 in debug mode; orjson writes both layouts
+        options = dict(kwargs)
+        separators = options.pop('separators', None)
+        indent = options.pop('indent', None)
+        sort_keys = options.pop('sort_keys', self.sort_keys)
+        compact = indent is None and separators in (None, (',', ':'))
+        if orjson is None or options or not (compact or (indent == 2 and separators is None)):
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj, self.default, sort_keys, indent=not compact).decode()
+
+
+def dumps_bytes(obj, default, sort_keys=False, indent=False):
+    if orjson is None:
+        return json.dumps(obj, default=default, sort_keys=sort_keys, indent=2 if indent else None).encode()
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=default, option=option)
+
+
+# Encode a string as a JSON string literal in pieces, so a large body is never copied whole
+def iter_json_string(text, chunk_size=64 * 1024):
+    yield b'"'
+    for start in range(0, len(text), chunk_size):
+        chunk = text[start:start + chunk_size]
+        # Strip the quotes each chunk is encoded with
+        if orjson is None:
+            yield json.dumps(chunk).encode()[1:-1]
+        else:
+            yield orjson.dumps(chunk)[1:-1]
+    yield b'"'
+
+
+# Stream a JSON object whose last field is a large string, e.g. a note body
+def iter_json_object(fields, text_field, text, default, chunk_size=64 * 1024):
+    head = dumps_bytes(fields, default)
+    if fields:
+        yield head[:-1] + b', ' + dumps_bytes(text_field, default) + b': '
+    else:
+        yield b'{' + dumps_bytes(text_field, default) + b': '
+    yield from iter_json_string(text, chunk_size)
+    yield b'}'
+
+
+# Raised for a line of a newline-delimited JSON archive that cannot be read
+class ArchiveError(ValueError):
+    def __init__(self, line_number, message):
+        super().__init__(f'Line {line_number}: {message}')
+        self.line_number = line_number
+
+
+# Compress a stream of byte chunks into a gzip stream
+def iter_gzip(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Split a stream of byte chunks into lines, joining only the pieces of each line
+def iter_lines(chunks):
+    pending = []
+    for chunk in chunks:
+        start = 0
+        end = chunk.find(b'\n')
+        while end >= 0:
+            pending.append(chunk[start:end])
+            yield b''.join(pending)
+            pending = []
+            start = end + 1
+            end = chunk.find(b'\n', start)
+        if start < len(chunk):
+            pending.append(chunk[start:])
+    if pending:
+        yield b''.join(pending)
+
+
+# Parse newline-delimited JSON from a stream of byte chunks, gzip-compressed or not, as (line number, value)
+# pairs. Blank lines are skipped.
+def iter_ndjson(chunks):
+    def decompressed(chunks):
+        decompressor = None
+        for chunk in chunks:
+            if decompressor is None:
+                if not chunk:
+                    continue
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:1] == b'\x1f' else False
+            yield decompressor.decompress(chunk) if decompressor else chunk
+        if decompressor and not decompressor.eof:
+            raise zlib.error('incomplete gzip stream')
+
+    loads = orjson.loads if orjson is not None else json.loads
+    line_number = 0
+    try:
+        for line in iter_lines(decompressed(chunks)):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield line_number, loads(line)
+            except ValueError:
+                raise ArchiveError(line_number, 'invalid JSON') from None
+    except zlib.error as error:
+        raise ArchiveError(line_number + 1, f'invalid gzip data ({error})') from None
@@ -1,13 +1,41 @@
+import asyncio
+import gzip
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
 import unittest
 import json
-from main import app, db, User, Notes, NotesShared, NoteVersionHistory
+from unittest import mock
+
+from werkzeug.test import Client
+
+# The engine is created when main is imported, so point it at the test database first. TEST_DATABASE=memory uses
+# an in-memory database shared by all of the pool's connections instead of instance/test.db.
+if os.environ.get('TEST_DATABASE') == 'memory':
+    TEST_DATABASE_URL = 'sqlite:///file:notes_test?mode=memory&cache=shared&uri=true'
+else:
+    TEST_DATABASE_URL = 'sqlite:///test.db'
+os.environ.setdefault('DATABASE_URL', TEST_DATABASE_URL)
+# Keep password hashing cheap; the production work factor is measured by benchmarks/bench_login.py
+os.environ.setdefault('PASSWORD_HASH_ITERATIONS', '1000')
+
+import main
+import serialization
+from batchwriter import BacklogFull, BatchWriter
+from caching import TTLCache
+from asgi import application
+from ratelimit import ConcurrencyLimiter
+from main import (app, db, User, Notes, NotesShared, NoteVersionHistory, migrate_schema, rebuild_search_index,
+                  credential_cache, note_cache, token_cache, history_writer, rate_limit_store)
 
 
 class TestAPI(unittest.TestCase):
 
     def setUp(self):
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test.db'
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URL
         self.app = app.test_client()
         with app.app_context():
             db.create_all()
@@ -16,6 +44,11 @@ class TestAPI(unittest.TestCase):
         with app.app_context():
             db.session.remove()
             db.drop_all()
+        # Ids are reused once the tables are recreated, so nothing cached may outlive a test
+        note_cache.clear()
+        token_cache.clear()
+        credential_cache.clear()
+        rate_limit_store.clear()
 
     def test_signup(self):
         with app.app_context():
@@ -38,6 +71,56 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(response.status_code, 201)
             self.assertEqual(data['message'], 'Signup successful')
 
+    def test_password_hashing(self):
+        with app.app_context():
+            response = self.app.post('/signup', json={'username': 'hashed', 'email': 'hashed@example.com',
+                                                      'password': 'secret'})
+            self.assertEqual(response.status_code, 201)
+            stored = User.query.filter_by(username='hashed').first().password
+            self.assertNotEqual(stored, 'secret')
+            self.assertTrue(stored.startswith('pbkdf2:sha256:1000$'))
+            response = self.app.post('/login', json={'username': 'hashed', 'password': 'secret'})
+            self.assertEqual(response.status_code, 200)
+            response = self.app.post('/login', json={'username': 'hashed', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 401)
+
+            # A plaintext row from before hashing is upgraded by its next successful login
+            db.session.add(User(username='legacy', email='legacy@example.com', password='old_secret'))
+            db.session.commit()
+            response = self.app.post('/login', json={'username': 'legacy', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 401)
+            response = self.app.post('/login', json={'username': 'legacy', 'password': 'old_secret'})
+            self.assertEqual(response.status_code, 200)
+            db.session.expire_all()
+            upgraded = User.query.filter_by(username='legacy').first().password
+            self.assertTrue(upgraded.startswith('pbkdf2:sha256:1000$'))
+            response = self.app.post('/login', json={'username': 'legacy', 'password': 'old_secret'})
+            self.assertEqual(response.status_code, 200)
+
+            # A changed work factor is applied on the next login as well
+            app.config['PASSWORD_HASH_ITERATIONS'] = 2000
+            try:
+                self.app.post('/login', json={'username': 'legacy', 'password': 'old_secret'})
+            finally:
+                app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+            db.session.expire_all()
+            self.assertTrue(User.query.filter_by(username='legacy').first().password.startswith('pbkdf2:sha256:2000$'))
+
+            # Credentials in the request body are verified against the hash too
+            response = self.app.post('/notes/create', json={'username': 'legacy', 'password': 'old_secret',
+                                                            'content': 'Hello'})
+            self.assertEqual(response.status_code, 201)
+            response = self.app.post('/notes/create', json={'username': 'legacy', 'password': 'wrong',
+                                                            'content': 'Hello'})
+            self.assertEqual(response.status_code, 401)
+
+            # An unknown username still costs a hash check, so timing does not reveal which usernames exist
+            with mock.patch('main.verify_password', wraps=main.verify_password) as verify:
+                response = self.app.post('/login', json={'username': 'nobody', 'password': 'secret'})
+            self.assertEqual(response.status_code, 401)
+            verify.assert_called_once()
+            self.assertTrue(verify.call_args.args[0].startswith('pbkdf2:sha256:1000$'))
+
     def test_login(self):
         with app.app_context():
             # Check if the user already exists
@@ -220,6 +303,125 @@ class TestAPI(unittest.TestCase):
             self.assertEqual(response.status_code, 403)
             self.assertEqual(data['message'], 'You are not authorized to update this note')
 
+    def test_optimistic_concurrency(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            note = Notes(user_id=user.userid, post_content='Original')
+            db.session.add(note)
+            db.session.commit()
+            note_id = note.note_id
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+
+            etag = self.app.get(f'/notes/{note_id}', json=credentials).headers['ETag']
+            response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='First'),
+                                    headers={'If-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['version'], 2)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+            # Writes based on an old version are rejected with the current one
+            response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Stale'),
+                                    headers={'If-Match': etag})
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.get_json()['version'], 2)
+            response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Stale', version=1))
+            self.assertEqual(response.status_code, 409)
+            response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Second', version=2))
+            self.assertEqual(response.status_code, 200)
+            response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Third'),
+                                    headers={'If-Match': '*'})
+            self.assertEqual(response.get_json()['version'], 4)
+
+            # Another write commits between this request's read and its UPDATE
+            def concurrent_write(*args):
+                with db.engine.begin() as connection:
+                    connection.execute(Notes.__table__.update().where(Notes.note_id == note_id).values(
+                        post_content='Concurrent', version=Notes.version + 1))
+                return True
+
+            with mock.patch('main.can_access_note', side_effect=concurrent_write):
+                response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Lost', version=4))
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.get_json()['version'], 5)
+            self.assertEqual(self.app.get(f'/notes/{note_id}', json=credentials).get_json()['content'], 'Concurrent')
+            history = self.app.get(f'/notes/version-history/{note_id}', json=credentials).get_json()
+            self.assertNotIn('Lost', [version['content'] for version in history['version_history']])
+
+            # Versions must be integers
+            for version in ('5', True, 5.0):
+                response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Typed', version=version))
+                self.assertEqual(response.status_code, 400)
+            response = self.app.patch(f'/notes/{note_id}', json=dict(credentials, version='5', edits=[]))
+            self.assertEqual(response.status_code, 400)
+
+            # An unconditional write is reapplied a few times, then gives up if other writes keep winning
+            flush = db.session.flush
+
+            def flush_after_concurrent_write(*args, **kwargs):
+                concurrent_write()
+                return flush(*args, **kwargs)
+
+            with mock.patch.object(db.session, 'flush', side_effect=flush_after_concurrent_write) as patched:
+                response = self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Starved'))
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(patched.call_count, 5)
+            self.assertEqual(response.get_json()['version'], 10)
+            db.session.rollback()
+            self.assertEqual(db.session.get(Notes, note_id).post_content, 'Concurrent')
+
+            # Batch updates check each item's version
+            response = self.app.put('/notes/batch', json=dict(credentials, notes=[
+                {'note_id': note_id, 'content': 'Batch', 'version': 4}, {'note_id': note_id, 'version': '10'}]))
+            self.assertEqual([result['status'] for result in response.get_json()['results']], [409, 400])
+            response = self.app.put('/notes/batch', json=dict(credentials, notes=[
+                {'note_id': note_id, 'content': 'Batch', 'version': 10}]))
+            self.assertEqual(response.get_json()['results'][0]['version'], 11)
+
+    def test_patch_note(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            original = ''.join(f'Line {i}\n' for i in range(200))
+            note_id = self.app.post('/notes/create', json=dict(credentials, content=original)).get_json()['note_id']
+
+            # Character range edits, given in any order
+            response = self.app.patch(f'/notes/{note_id}', json=dict(credentials, version=1, edits=[
+                {'start': original.index('Line 150'), 'end': original.index('Line 150') + 4, 'text': 'Row'},
+                {'start': 0, 'end': 0, 'text': 'Title\n'}]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['version'], 2)
+            patched = 'Title\n' + original.replace('Line 150', 'Row 150')
+            self.assertEqual(self.app.get(f'/notes/{note_id}', json=credentials).get_json()['content'], patched)
+
+            # A unified diff; the history stores only a small delta for it
+            diff = '--- a\n+++ b\n@@ -100,3 +100,3 @@\n Line 98\n-Line 99\n+Line ninety-nine\n Line 100\n'
+            response = self.app.patch(f'/notes/{note_id}', json=dict(credentials, patch=diff),
+                                      headers={'If-Match': response.headers['ETag']})
+            self.assertEqual(response.status_code, 200)
+            patched = patched.replace('Line 99\n', 'Line ninety-nine\n')
+            latest = NoteVersionHistory.query.filter_by(note_id=note_id).order_by(NoteVersionHistory.id.desc()).first()
+            self.assertTrue(latest.is_delta)
+            self.assertLess(len(latest.content), 100)
+            history = self.app.get(f'/notes/version-history/{note_id}', json=credentials).get_json()
+            self.assertEqual([version['content'] for version in history['version_history']][:3],
+                             [patched, 'Title\n' + original.replace('Line 150', 'Row 150'), original])
+
+            # Patches that do not fit the current content change nothing
+            response = self.app.patch(f'/notes/{note_id}', json=dict(credentials, patch=diff))
+            self.assertEqual(response.status_code, 422)
+            response = self.app.patch(f'/notes/{note_id}', json=dict(credentials, edits=[
+                {'start': 0, 'end': 10 ** 6, 'text': ''}]))
+            self.assertEqual(response.status_code, 422)
+            response = self.app.patch(f'/notes/{note_id}', json=dict(credentials, version=2, edits=[]))
+            self.assertEqual(response.status_code, 409)
+            response = self.app.patch(f'/notes/{note_id}', json=credentials)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(self.app.get(f'/notes/{note_id}', json=credentials).get_json()['content'], patched)
+
     def test_get_version_history(self):
         with app.app_context():
             # Check if the user already exists
@@ -246,6 +448,19 @@ class TestAPI(unittest.TestCase):
             self.assertIn('note_id', data)
             self.assertIn('version_history', data)
 
+            # Other users may not read the history until the note is shared with them
+            other_user = User(username='other_user', email='other@example.com', password='other_password')
+            db.session.add(other_user)
+            db.session.commit()
+            other_credentials = {'username': 'other_user', 'password': 'other_password'}
+            response = self.app.get(f'/notes/version-history/{note.note_id}', json=other_credentials)
+            self.assertEqual(response.status_code, 403)
+            self.assertNotIn('Original content', response.get_data(as_text=True))
+            self.app.post('/notes/share', json={'username': 'test_user', 'password': 'test_password',
+                                                'note_id': note.note_id, 'shared_with_user_id': other_user.userid})
+            response = self.app.get(f'/notes/version-history/{note.note_id}', json=other_credentials)
+            self.assertEqual(response.status_code, 200)
+
     def test_share_note(self):
         with app.app_context():
             # Check if the user already exists
@@ -280,6 +495,869 @@ class TestAPI(unittest.TestCase):
             shared_notes = NotesShared.query.filter_by(shared_with_user_id=shared_user.userid).all()
             self.assertTrue(any(note.note_id == shared_notes[0].note_id for note in shared_notes))
 
+    def test_bulk_share(self):
+        with app.app_context():
+            owner = User(username='owner', email='owner@example.com', password='pw')
+            users = [User(username=f'member{i}', email=f'member{i}@example.com', password='pw') for i in range(5)]
+            db.session.add_all([owner, *users])
+            db.session.commit()
+            note = Notes(user_id=owner.userid, post_content='Team note')
+            db.session.add(note)
+            db.session.commit()
+            owner_auth = {'username': 'owner', 'password': 'pw'}
+            member_auth = {'username': 'member4', 'password': 'pw'}
+            user_ids = [user.userid for user in users]
+
+            response = self.app.post('/groups', json={**owner_auth, 'name': 'team', 'member_ids': user_ids[3:]})
+            self.assertEqual(response.status_code, 201)
+            group_id = response.get_json()['group_id']
+
+            # Not shared yet; the member's access set is cached by this request
+            response = self.app.get(f'/notes/{note.note_id}', json=member_auth)
+            self.assertIn('Error', response.get_json())
+
+            # Unknown users fail the whole request
+            response = self.app.post('/notes/share', json={**owner_auth, 'note_id': note.note_id,
+                                                           'shared_with_user_ids': [user_ids[0], 9998, 9999]})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.get_json()['message'], 'Users with IDs 9998, 9999 not found')
+            response = self.app.post('/notes/share', json={**owner_auth, 'note_id': note.note_id, 'groups': ['nope']})
+            self.assertEqual(response.status_code, 404)
+
+            # Users and groups in one call, duplicates and existing shares ignored
+            response = self.app.post('/notes/share', json={
+                **owner_auth, 'note_id': note.note_id, 'shared_with_user_id': user_ids[0],
+                'shared_with_user_ids': [user_ids[0], user_ids[1], user_ids[3], owner.userid], 'groups': ['team']})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.get_json()['added_user_ids'], [user_ids[0], user_ids[1], user_ids[3], user_ids[4]])
+            response = self.app.post('/notes/share', json={**owner_auth, 'note_id': note.note_id,
+                                                           'shared_with_user_ids': user_ids})
+            self.assertEqual(response.get_json()['added_user_ids'], [user_ids[2]])
+            self.assertEqual(NotesShared.query.filter_by(note_id=note.note_id).count(), 5)
+            share = NotesShared.query.filter_by(shared_with_user_id=user_ids[0]).first()
+            self.assertEqual(share.author_id, owner.userid)
+            self.assertIsNotNone(share.note_last_modified)
+
+            response = self.app.get(f'/notes/{note.note_id}', json=member_auth)
+            self.assertEqual(response.get_json()['content'], 'Team note')
+            # The cached access list is plain JSON-compatible data
+            self.assertEqual(main.note_cache.get(f'shared:{user_ids[4]}'), [note.note_id])
+
+            # Groups resolve only among the caller's own groups
+            member_note = Notes(user_id=user_ids[4], post_content='Member note')
+            db.session.add(member_note)
+            db.session.commit()
+            response = self.app.post('/notes/share', json={**member_auth, 'note_id': member_note.note_id,
+                                                           'groups': ['team']})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.get_json()['message'], 'Groups not found: team')
+
+            # Only the owner may share or unshare
+            response = self.app.post('/notes/unshare', json={**member_auth, 'note_id': note.note_id,
+                                                             'groups': ['team']})
+            self.assertEqual(response.status_code, 403)
+
+            response = self.app.post('/notes/unshare', json={**owner_auth, 'note_id': note.note_id, 'groups': ['team']})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['removed_user_ids'], user_ids[3:])
+            response = self.app.get(f'/notes/{note.note_id}', json=member_auth)
+            self.assertIn('Error', response.get_json())
+            self.assertEqual(NotesShared.query.filter_by(note_id=note.note_id).count(), 3)
+
+            # Group membership can be replaced by its owner only
+            response = self.app.put(f'/groups/{group_id}/members', json={**member_auth, 'member_ids': []})
+            self.assertEqual(response.status_code, 403)
+            response = self.app.put(f'/groups/{group_id}/members', json={**owner_auth, 'member_ids': user_ids[:2]})
+            self.assertEqual(response.get_json()['member_ids'], user_ids[:2])
+            response = self.app.post('/notes/unshare', json={**owner_auth, 'note_id': note.note_id, 'groups': ['team']})
+            self.assertEqual(response.get_json()['removed_user_ids'], user_ids[:2])
+
+    def test_token_auth(self):
+        with app.app_context():
+            user = User(username='token_user', email='token@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            note = Notes(user_id=user.userid, post_content='Token note')
+            db.session.add(note)
+            db.session.commit()
+
+            response = self.app.post('/login', json={'username': 'token_user', 'password': 'test_password'})
+            token = json.loads(response.data)['token']
+
+            # Test getting a note with the token from /login, twice to hit the token cache
+            for _ in range(2):
+                response = self.app.get(f'/notes/{note.note_id}', headers={'Authorization': f'Bearer {token}'})
+                data = json.loads(response.data)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(data['content'], 'Token note')
+
+            # Test creating a note with the token
+            response = self.app.post('/notes/create', headers={'Authorization': f'Bearer {token}'},
+                                     json={'content': 'Created with token'})
+            self.assertEqual(response.status_code, 201)
+
+            # Test a tampered token
+            response = self.app.get(f'/notes/{note.note_id}', headers={'Authorization': f'Bearer {token}x'})
+            self.assertEqual(response.status_code, 401)
+
+    def test_rate_limiting(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            note = Notes(user_id=user.userid, post_content='Limited note')
+            db.session.add(note)
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            token = json.loads(self.app.post('/login', json=credentials).data)['token']
+            headers = {'Authorization': f'Bearer {token}'}
+            rate_limit_store.clear()
+            limits = {'RATE_LIMIT_LOGIN': (0.01, 3), 'RATE_LIMIT_PER_USER': (0.01, 2)}
+            with mock.patch.dict(app.config, limits):
+                # Failed password checks are limited per IP, through /login or any endpoint that takes a password
+                wrong = dict(credentials, password='wrong')
+                for _ in range(5):
+                    self.assertEqual(self.app.post('/login', json=credentials).status_code, 200)
+                self.assertEqual(self.app.post('/login', json=wrong).status_code, 401)
+                self.assertEqual(self.app.get(f'/notes/{note.note_id}', json=wrong).status_code, 401)
+                self.assertEqual(self.app.put(f'/notes/{note.note_id}', json=dict(wrong, content='x')).status_code,
+                                 401)
+                for response in (self.app.post('/login', json=credentials),
+                                 self.app.get(f'/notes/{note.note_id}', json=wrong)):
+                    self.assertEqual(response.status_code, 429)
+                    self.assertEqual(json.loads(response.data)['message'], 'Too many requests')
+                    self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+                response = self.app.post('/login', json=credentials, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+                self.assertEqual(response.status_code, 200)
+
+                # Every signup is charged, as each hashes a password
+                for i in range(3):
+                    response = self.app.post('/signup', json={'username': f'new{i}', 'email': f'new{i}@example.com',
+                                                              'password': 'pw'}, environ_base={'REMOTE_ADDR': '10.0.0.4'})
+                    self.assertEqual(response.status_code, 201)
+                response = self.app.post('/signup', json={'username': 'new3', 'email': 'new3@example.com',
+                                                          'password': 'pw'}, environ_base={'REMOTE_ADDR': '10.0.0.4'})
+                self.assertEqual(response.status_code, 429)
+
+                # Token requests are limited per user, from any address
+                for _ in range(2):
+                    self.assertEqual(self.app.get(f'/notes/{note.note_id}', headers=headers).status_code, 200)
+                response = self.app.get(f'/notes/{note.note_id}', headers=headers,
+                                        environ_base={'REMOTE_ADDR': '10.0.0.3'})
+                self.assertEqual(response.status_code, 429)
+                response = self.app.get(f'/notes/{note.note_id}', json=credentials,
+                                        environ_base={'REMOTE_ADDR': '10.0.0.3'})
+                self.assertEqual(response.status_code, 200)
+
+            # Past the concurrency cap requests are shed before they run, except for /metrics
+            rate_limit_store.clear()
+            with mock.patch('main.admission', ConcurrencyLimiter(1)) as limiter, \
+                    mock.patch.dict(app.config, {'ADMISSION_TIMEOUT': 0}):
+                self.assertTrue(limiter.acquire(0))
+                with mock.patch('main.user_id_from_token', wraps=main.user_id_from_token) as lookup:
+                    response = self.app.get(f'/notes/{note.note_id}', headers=headers)
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], '1')
+                # The token is only verified once a request is admitted, since that may query the database
+                lookup.assert_not_called()
+                self.assertEqual(self.app.get('/metrics').status_code, 200)
+                limiter.release()
+                self.assertEqual(self.app.get(f'/notes/{note.note_id}', headers=headers).status_code, 200)
+                # The slot is given back once the response is done
+                self.assertTrue(limiter.acquire(0))
+                limiter.release()
+
+    def test_migrate_schema(self):
+        with app.app_context():
+            # Simulate a database created before the indexes existed
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.drop(bind=db.engine)
+            # ... and with the single-column indexes the listing indexes replaced
+            db.session.execute(db.text('CREATE INDEX ix_notes_user_id ON notes (user_id)'))
+            db.session.execute(db.text(
+                'CREATE INDEX ix_notes_shared_shared_with_user_id ON notes_shared (shared_with_user_id)'))
+            db.session.commit()
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            shared_user = User(username='shared_user', email='shared@example.com', password='shared_password')
+            db.session.add_all([user, shared_user])
+            db.session.commit()
+            note = Notes(user_id=user.userid, post_content='Original content')
+            db.session.add(note)
+            db.session.commit()
+            db.session.add_all([NotesShared(note_id=note.note_id, author_id=user.userid,
+                                            shared_with_user_id=shared_user.userid) for _ in range(2)])
+            db.session.commit()
+
+            # The migration removes duplicate shares and can be run repeatedly
+            migrate_schema()
+            migrate_schema()
+            self.assertEqual(NotesShared.query.filter_by(note_id=note.note_id).count(), 1)
+            index_names = {index['name'] for index in db.inspect(db.engine).get_indexes('notes_shared')}
+            self.assertIn('uq_notes_shared_note_id_shared_with_user_id', index_names)
+            self.assertNotIn('ix_notes_shared_shared_with_user_id', index_names)
+            self.assertNotIn('ix_notes_user_id', {index['name'] for index in db.inspect(db.engine).get_indexes('notes')})
+            self.assertNotIn('ix_notes_user_id', {index.name for index in Notes.__table__.indexes})
+
+            # Once the unique index exists, startup no longer scans the table for duplicates
+            with mock.patch.object(db.session, 'execute', wraps=db.session.execute) as execute:
+                migrate_schema()
+            self.assertFalse(any('DELETE FROM notes_shared' in str(call.args[0]) for call in execute.call_args_list))
+
+            # Sharing the same note again does not create another row
+            response = self.app.post('/notes/share',
+                                     json={'username': 'test_user', 'password': 'test_password',
+                                           'note_id': note.note_id, 'shared_with_user_id': shared_user.userid})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(NotesShared.query.filter_by(note_id=note.note_id).count(), 1)
+
+    def test_version_history_pagination(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            app.config['HISTORY_SNAPSHOT_INTERVAL'] = 4
+            histories = {}
+            try:
+                # Apply the same edits under both storage modes
+                # A batch size smaller than the note's history compacts it in several transactions
+                for storage, batch_size in (('full', '200'), ('delta', '200'), ('full', '3'), ('delta', '3')):
+                    app.config['HISTORY_STORAGE'] = storage
+                    response = self.app.post('/notes/create', json=dict(credentials, content='line 1\nline 2\n'))
+                    note_id = json.loads(response.data)['note_id']
+                    for i in range(10):
+                        content = f'line 1\nedit {i}\nline 2\n' + 'tail\n' * i
+                        self.app.put(f'/notes/{note_id}', json=dict(credentials, content=content))
+
+                    # Walk the history two versions at a time
+                    pages = []
+                    cursor = ''
+                    while cursor is not None:
+                        response = self.app.get(f'/notes/version-history/{note_id}?limit=2&cursor={cursor}',
+                                                json=credentials)
+                        data = json.loads(response.data)
+                        self.assertEqual(response.status_code, 200)
+                        self.assertLessEqual(len(data['version_history']), 2)
+                        pages.extend(data['version_history'])
+                        cursor = data['next_cursor']
+
+                    response = self.app.get(f'/notes/version-history/{note_id}', json=credentials)
+                    data = json.loads(response.data)
+                    self.assertEqual(pages, data['version_history'])
+                    self.assertEqual(len(pages), 11)
+                    self.assertEqual(pages[0]['content'], Notes.query.get(note_id).post_content)
+                    histories[storage] = [version['content'] for version in pages]
+            finally:
+                app.config['HISTORY_STORAGE'] = 'full'
+                app.config['HISTORY_SNAPSHOT_INTERVAL'] = 50
+
+            self.assertEqual(histories['full'], histories['delta'])
+            self.assertTrue(NoteVersionHistory.query.filter_by(is_delta=True).count() > 0)
+
+    def test_compact_history(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            app.config['HISTORY_SNAPSHOT_INTERVAL'] = 4
+            try:
+                # A batch size smaller than the note's history compacts it in several transactions
+                for storage, batch_size in (('full', '200'), ('delta', '200'), ('full', '3'), ('delta', '3')):
+                    app.config['HISTORY_STORAGE'] = storage
+                    response = self.app.post('/notes/create', json=dict(credentials, content='line 1\n'))
+                    note_id = json.loads(response.data)['note_id']
+                    # Each edit appends a line, so a delta applied to the wrong base gives the wrong content
+                    for i in range(12):
+                        content = 'line 1\n' + ''.join(f'edit {j}\n' for j in range(i + 1))
+                        self.app.put(f'/notes/{note_id}', json=dict(credentials, content=content))
+                    # Versions 0-8 were saved two a day, from six days ago; versions 9-12 are recent
+                    versions = NoteVersionHistory.query.filter_by(note_id=note_id).order_by(NoteVersionHistory.id)
+                    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+                    for position, version in enumerate(versions.all()[:9]):
+                        version.modified_date = today - timedelta(days=6 - position // 2, hours=-1 - position % 2)
+                    db.session.commit()
+                    response = self.app.get(f'/notes/version-history/{note_id}', json=credentials)
+                    before = json.loads(response.data)['version_history']
+
+                    # Between transactions every remaining version still reads back unchanged
+                    apply = main.apply_note_compaction
+                    chunks = []
+
+                    def check_then_apply(deleted, updates):
+                        history = self.app.get(f'/notes/version-history/{note_id}', json=credentials).get_json()
+                        for version in history['version_history']:
+                            self.assertIn(version, before)
+                        chunks.append(deleted)
+                        return apply(deleted, updates)
+
+                    with mock.patch('main.apply_note_compaction', side_effect=check_then_apply):
+                        result = app.test_cli_runner().invoke(args=['compact-history', '--keep-last', '2',
+                                                                    '--keep-days', '1', '--batch-size', batch_size])
+                    self.assertEqual(result.exit_code, 0, result.output)
+                    self.assertIn('Deleted 4 versions from 1 notes', result.output)
+                    self.assertEqual(len(chunks) > 1, batch_size == '3')
+                    response = self.app.get(f'/notes/version-history/{note_id}', json=credentials)
+                    after = json.loads(response.data)['version_history']
+                    # The newest of each old day is kept along with every recent version
+                    self.assertEqual(after, [before[i] for i in (0, 1, 2, 3, 4, 5, 7, 9, 11)])
+                    self.assertFalse(versions.first().is_delta)
+
+                    result = app.test_cli_runner().invoke(args=['compact-history', '--keep-last', '2',
+                                                                '--keep-days', '0', '--no-daily'])
+                    self.assertEqual(result.exit_code, 0, result.output)
+                    response = self.app.get(f'/notes/version-history/{note_id}', json=credentials)
+                    self.assertEqual(json.loads(response.data)['version_history'], before[:2])
+            finally:
+                app.config['HISTORY_STORAGE'] = 'full'
+                app.config['HISTORY_SNAPSHOT_INTERVAL'] = 50
+
+    def test_export_import(self):
+        with app.app_context():
+            for name in ('owner', 'reader', 'restored'):
+                db.session.add(User(username=name, email=f'{name}@example.com', password='test_password'))
+            db.session.commit()
+            owner = {'username': 'owner', 'password': 'test_password'}
+            app.config['HISTORY_STORAGE'] = 'delta'
+            try:
+                note_ids = []
+                for i in range(3):
+                    response = self.app.post('/notes/create', json=dict(owner, content=f'note {i}\n'))
+                    note_ids.append(json.loads(response.data)['note_id'])
+                for i in range(3):
+                    self.app.put(f'/notes/{note_ids[0]}', json=dict(owner, content=f'note 0\nedit {i}\n'))
+            finally:
+                app.config['HISTORY_STORAGE'] = 'full'
+            reader_id = User.query.filter_by(username='reader').first().userid
+            for note_id in note_ids[:2]:
+                self.app.post('/notes/share', json=dict(owner, note_id=note_id, shared_with_user_id=reader_id))
+
+            response = self.app.get('/notes/export', json=owner)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            archive = response.data
+            records = [json.loads(line) for line in archive.splitlines()]
+            self.assertEqual(records[0]['type'], 'export')
+            self.assertEqual([record['type'] for record in records[1:]],
+                             ['note'] + ['version'] * 4 + ['share', 'note', 'version', 'share', 'note', 'version'])
+            self.assertTrue(any(record.get('is_delta') for record in records))
+            response = self.app.get('/notes/export?format=gzip', json=owner)
+            self.assertEqual(response.mimetype, 'application/gzip')
+            compressed = [json.loads(line) for line in gzip.decompress(response.data).splitlines()]
+            self.assertEqual(compressed[1:], records[1:])
+            self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename=notes-owner.ndjson.gz')
+
+            # Usernames outside Latin-1 or with quotes still give a valid header, with the UTF-8 name in filename*
+            db.session.add(User(username='\u65e5\u672c"', email='nihon@example.com', password='test_password'))
+            db.session.commit()
+            named = self.app.get('/notes/export', json={'username': '\u65e5\u672c"', 'password': 'test_password'})
+            self.assertEqual(named.status_code, 200)
+            self.assertEqual(len(named.get_data().splitlines()), 1)
+            self.assertEqual(named.headers['Content-Disposition'],
+                             'attachment; filename="notes-\\".ndjson"; '
+                             "filename*=UTF-8''notes-%E6%97%A5%E6%9C%AC%22.ndjson")
+
+            # Import into another account, from the compressed archive
+            token = json.loads(self.app.post('/login', json={'username': 'restored', 'password': 'test_password'})
+                               .data)['token']
+            response = self.app.post('/notes/import', data=response.data, content_type='application/gzip',
+                                     headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(json.loads(response.data)['imported'],
+                             {'notes': 3, 'versions': 6, 'shares': 2, 'skipped_shares': 0})
+            restored = {'username': 'restored', 'password': 'test_password'}
+            new_ids = [note.note_id for note in Notes.query.filter_by(
+                user_id=User.query.filter_by(username='restored').first().userid).order_by(Notes.note_id)]
+            for old_id, new_id in zip(note_ids, new_ids):
+                old = json.loads(self.app.get(f'/notes/version-history/{old_id}', json=owner).data)
+                new = json.loads(self.app.get(f'/notes/version-history/{new_id}', json=restored).data)
+                self.assertEqual([(version['content'], version['modified_date']) for version in old['version_history']],
+                                 [(version['content'], version['modified_date']) for version in new['version_history']])
+            self.assertEqual(NotesShared.query.filter(NotesShared.note_id.in_(new_ids)).count(), 2)
+            reader = {'username': 'reader', 'password': 'test_password'}
+            self.assertEqual(self.app.get(f'/notes/{new_ids[0]}', json=reader).status_code, 200)
+
+            # A malformed line stops the import; earlier batches stay committed
+            lines = archive.splitlines()
+            with mock.patch.dict(app.config, {'IMPORT_BATCH_SIZE': 2}):
+                response = self.app.post('/notes/import', data=b'\n'.join(lines[:7] + [b'{"type": "note"}']),
+                                         headers={'Authorization': f'Bearer {token}'})
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['message'], 'Line 8: invalid note record')
+            self.assertEqual(data['imported']['versions'], 4)
+            response = self.app.post('/notes/import', data=b'\n'.join(lines[1:]),
+                                     headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(response.status_code, 400)
+
+            # The same archive through the CLI
+            path = os.path.join(tempfile.mkdtemp(), 'owner.ndjson.gz')
+            result = app.test_cli_runner().invoke(args=['export-notes', 'owner', '-o', path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            result = app.test_cli_runner().invoke(args=['import-notes', 'reader', path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Imported 3 notes, 6 versions and 0 shares (2 shares with unknown users or with reader '
+                          'skipped)', result.output)
+
+    def test_batch_notes(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            other_user = User(username='other_user', email='other@example.com', password='test_password')
+            db.session.add_all([user, other_user])
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            other_note = Notes(user_id=other_user.userid, post_content='Not yours')
+            db.session.add(other_note)
+            db.session.commit()
+
+            # Test batch creation, including an invalid item
+            response = self.app.post('/notes/batch', json=dict(credentials, notes=[
+                {'content': 'First'}, {'content': 'Second'}, 'not a note']))
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual([result['status'] for result in data['results']], [201, 201, 400])
+            note_ids = [result['note_id'] for result in data['results'][:2]]
+            self.assertEqual(NoteVersionHistory.query.filter(NoteVersionHistory.note_id.in_(note_ids)).count(), 2)
+
+            # Test batch update with a missing note and a note owned by someone else
+            response = self.app.put('/notes/batch', json=dict(credentials, notes=[
+                {'note_id': note_ids[0], 'content': 'First updated'},
+                {'note_id': 999, 'content': 'Missing'},
+                {'note_id': other_note.note_id, 'content': 'Not allowed'}]))
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([result['status'] for result in data['results']], [200, 404, 403])
+            self.assertEqual(NoteVersionHistory.query.filter_by(note_id=note_ids[0]).count(), 2)
+
+            # Booleans are not note ids, even though true == 1 in Python
+            response = self.app.put('/notes/batch', json=dict(credentials, notes=[{'note_id': True, 'content': 'x'}]))
+            self.assertEqual(json.loads(response.data)['results'], [{'index': 0, 'status': 400,
+                                                                     'message': 'Invalid note'}])
+            response = self.app.get('/notes/batch', json=dict(credentials, note_ids=[True]))
+            self.assertEqual(json.loads(response.data)['results'][0]['status'], 400)
+
+            # Test batch fetch
+            response = self.app.get('/notes/batch', json=dict(credentials, note_ids=note_ids + [other_note.note_id]))
+            data = json.loads(response.data)
+            self.assertEqual([result['status'] for result in data['results']], [200, 200, 403])
+            self.assertEqual(data['results'][0]['content'], 'First updated')
+
+            # Test an empty batch and invalid credentials
+            response = self.app.post('/notes/batch', json=dict(credentials, notes=[]))
+            self.assertEqual(response.status_code, 400)
+            # A batch in which every item is invalid creates nothing
+            response = self.app.post('/notes/batch', json=dict(credentials, notes=['not a note', {'content': 1}]))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual([result['status'] for result in json.loads(response.data)['results']], [400, 400])
+            response = self.app.get('/notes/batch', json={'note_ids': note_ids})
+            self.assertEqual(response.status_code, 401)
+
+    def test_search_notes(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            other_user = User(username='other_user', email='other@example.com', password='test_password')
+            db.session.add_all([user, other_user])
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            own_note = Notes(user_id=user.userid, post_content='Shopping list: apples and pears')
+            shared_note = Notes(user_id=other_user.userid, post_content='Apples apples apples pie recipe')
+            private_note = Notes(user_id=other_user.userid, post_content='Secret apples')
+            db.session.add_all([own_note, shared_note, private_note])
+            db.session.commit()
+            db.session.add(NotesShared(note_id=shared_note.note_id, author_id=other_user.userid,
+                                       shared_with_user_id=user.userid))
+            db.session.commit()
+
+            # Test ranked results limited to owned and shared notes
+            response = self.app.get('/notes/search?q=apples', json=credentials)
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([result['note_id'] for result in data['results']], [shared_note.note_id, own_note.note_id])
+            self.assertIn('[apples]', data['results'][1]['snippet'].lower())
+
+            # Test pagination
+            response = self.app.get('/notes/search?q=apples&limit=1', json=credentials)
+            data = json.loads(response.data)
+            self.assertEqual(len(data['results']), 1)
+            self.assertEqual(data['next_page'], 2)
+
+            # Test that updates are reflected and that the index can be rebuilt
+            self.app.put(f'/notes/{own_note.note_id}', json=dict(credentials, content='Bananas only'))
+            rebuild_search_index()
+            response = self.app.get('/notes/search?q=bananas', json=credentials)
+            self.assertEqual([result['note_id'] for result in json.loads(response.data)['results']], [own_note.note_id])
+            response = self.app.get('/notes/search?q=pears', json=credentials)
+            self.assertEqual(json.loads(response.data)['results'], [])
+
+            # Test query syntax is not interpreted
+            response = self.app.get('/notes/search?q=apples" OR', json=credentials)
+            self.assertEqual(response.status_code, 200)
+            response = self.app.get('/notes/search?q=***', json=credentials)
+            self.assertEqual(response.status_code, 400)
+
+    def test_note_cache_and_etag(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            other_user = User(username='other_user', email='other@example.com', password='test_password')
+            db.session.add_all([user, other_user])
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            other_credentials = {'username': 'other_user', 'password': 'test_password'}
+            response = self.app.post('/notes/create', json=dict(credentials, content='Original content'))
+            note_id = json.loads(response.data)['note_id']
+
+            # Test conditional GET with the ETag from a previous response
+            response = self.app.get(f'/notes/{note_id}', json=credentials)
+            etag = response.headers['ETag']
+            response = self.app.get(f'/notes/{note_id}', json=credentials, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            # Test that an update invalidates the cached note and changes the ETag
+            self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Updated content'))
+            response = self.app.get(f'/notes/{note_id}', json=credentials, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)['content'], 'Updated content')
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+            # Test that sharing invalidates a cached denial
+            response = self.app.get(f'/notes/{note_id}', json=other_credentials)
+            self.assertIn('Error', json.loads(response.data))
+            self.app.post('/notes/share', json=dict(credentials, note_id=note_id, shared_with_user_id=other_user.userid))
+            response = self.app.get(f'/notes/{note_id}', json=other_credentials)
+            self.assertEqual(json.loads(response.data)['content'], 'Updated content')
+            self.assertGreater(note_cache.nbytes, 0)
+
+            # Test that a read overlapping an invalidation does not cache what it read, so an unshare takes
+            # effect at once rather than when a stale list expires
+            note_cache.clear()
+            scalars, get = db.session.scalars, db.session.get
+
+            def scalars_then_unshare(*args, **kwargs):
+                result = list(scalars(*args, **kwargs))
+                main.invalidate_shared([other_user.userid])
+                return result
+
+            def get_then_update(*args, **kwargs):
+                result = get(*args, **kwargs)
+                main.invalidate_note(note_id)
+                return result
+
+            with mock.patch.object(db.session, 'scalars', scalars_then_unshare), \
+                    mock.patch.object(db.session, 'get', get_then_update):
+                self.assertEqual(main.shared_note_ids(other_user.userid), [note_id])
+                self.assertEqual(main.get_cached_note(note_id)['content'], 'Updated content')
+            self.assertIsNone(note_cache.get(f'shared:{other_user.userid}'))
+            self.assertIsNone(note_cache.get(f'note:{note_id}'))
+            main.shared_note_ids(other_user.userid)
+            main.get_cached_note(note_id)
+            self.assertEqual(note_cache.get(f'shared:{other_user.userid}'), [note_id])
+            self.assertIsNotNone(note_cache.get(f'note:{note_id}'))
+
+        # Test that the cache is bounded by the memory of its entries as well as their number
+        cache = TTLCache(maxsize=100, ttl=60, maxbytes=7 * 512 * 1024, sizeof=main.note_cache_sizeof)
+        for i in range(5):
+            cache.set(f'note:{i}', {'note_id': i, 'user_id': 1, 'content': 'x' * 1024 * 1024, 'etag': '"1"'})
+        self.assertEqual([cache.get(f'note:{i}') is not None for i in range(5)], [False, False, True, True, True])
+        self.assertLessEqual(cache.nbytes, cache.maxbytes)
+        cache.set('shared:1', list(range(1000000)))
+        self.assertIsNone(cache.get('shared:1'))
+        cache.set('shared:1', list(range(1000)))
+        cache.delete('note:2')
+        cache.delete('note:3')
+        cache.delete('note:4')
+        self.assertEqual(cache.nbytes, main.note_cache_sizeof(list(range(1000))))
+
+    def test_async_history_matches_sync(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            histories = {}
+            try:
+                for mode in ('sync', 'async'):
+                    app.config['HISTORY_WRITE_MODE'] = mode
+                    response = self.app.post('/notes/create', json=dict(credentials, content='Version 0'))
+                    note_id = json.loads(response.data)['note_id']
+                    for i in range(1, 20):
+                        self.app.put(f'/notes/{note_id}', json=dict(credentials, content=f'Version {i}'))
+                    response = self.app.post('/notes/batch', json=dict(credentials, notes=[{'content': 'Batch'}]))
+                    batch_note_id = json.loads(response.data)['results'][0]['note_id']
+
+                    # Queued versions are all written once the writer has drained
+                    history_writer.drain()
+                    response = self.app.get(f'/notes/version-history/{note_id}', json=credentials)
+                    histories[mode] = [version['content'] for version in json.loads(response.data)['version_history']]
+                    self.assertEqual(NoteVersionHistory.query.filter_by(note_id=batch_note_id).count(), 1)
+            finally:
+                app.config['HISTORY_WRITE_MODE'] = 'sync'
+                history_writer.stop()
+
+            self.assertEqual(len(histories['sync']), 20)
+            self.assertEqual(histories['sync'], histories['async'])
+
+    def test_batch_writer_retries_failed_batches(self):
+        def run(flush, items, **options):
+            written, set_aside = [], []
+            writer = BatchWriter(lambda batch: flush(batch) or written.extend(batch), flush_interval=0.001,
+                                 max_backoff=0.01, on_failed=lambda item, error: set_aside.append(item), **options)
+            writer.submit(items)
+            self.assertTrue(writer.drain(5))
+            writer.stop()
+            return sorted(written), set_aside
+
+        # Transient failures are retried until the batch is written
+        calls = []
+
+        def flaky(batch):
+            calls.append(batch)
+            if len(calls) < 3:
+                raise RuntimeError('database is locked')
+
+        with self.assertLogs('batchwriter', 'ERROR'):
+            self.assertEqual(run(flaky, [1, 2]), ([1, 2], []))
+
+        # An item that can never be written is set aside on its own once its batch has used up its attempts
+        def poisoned(batch):
+            if 3 in batch:
+                raise ValueError('cannot apply delta')
+
+        with self.assertLogs('batchwriter', 'ERROR'):
+            self.assertEqual(run(poisoned, [1, 2, 3, 4], attempts=2), ([1, 2, 4], [3]))
+
+        # A sink that never recovers neither blocks producers forever nor keeps the process from stopping
+        set_aside = []
+
+        def broken(batch):
+            raise RuntimeError('disk I/O error')
+
+        writer = BatchWriter(broken, max_backlog=2, batch_size=2, flush_interval=0.001, max_backoff=0.01,
+                             attempts=1000, submit_timeout=0.05, on_failed=lambda item, error: set_aside.append(item))
+        with self.assertLogs('batchwriter', 'ERROR'):
+            with self.assertRaises(BacklogFull) as raised:
+                writer.submit([1, 2, 3, 4, 5])
+            self.assertTrue(raised.exception.items)
+            start = time.monotonic()
+            writer.stop(timeout=0.1)
+            self.assertLess(time.monotonic() - start, 2)
+            # Items queued or in flight at shutdown are set aside instead of lost
+            deadline = time.monotonic() + 5
+            while len(set_aside) + len(raised.exception.items) < 5 and time.monotonic() < deadline:
+                time.sleep(0.001)
+        self.assertEqual(sorted(set_aside + raised.exception.items), [1, 2, 3, 4, 5])
+
+        # A request whose versions cannot be queued gets a 503; they are written to HISTORY_FAILED_PATH instead
+        with app.app_context():
+            db.session.add(User(username='test_user', email='test@example.com', password='test_password'))
+            db.session.commit()
+        credentials = {'username': 'test_user', 'password': 'test_password'}
+        failed_path = os.path.join(tempfile.mkdtemp(), 'history_failed.ndjson')
+
+        def full(items):
+            raise BacklogFull(items)
+
+        with mock.patch.dict(app.config, {'HISTORY_WRITE_MODE': 'async', 'HISTORY_FAILED_PATH': failed_path}), \
+                mock.patch.object(history_writer, 'submit', side_effect=full):
+            response = self.app.post('/notes/create', json=dict(credentials, content='Kept on disk'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        with open(failed_path) as failed:
+            records = [json.loads(line) for line in failed]
+        self.assertEqual([(record['content'], record['delta']) for record in records], [('Kept on disk', False)])
+
+    def test_asgi_streams_large_request_bodies(self):
+        with app.app_context():
+            db.session.add(User(username='test_user', email='test@example.com', password='test_password'))
+            db.session.commit()
+        content = 'Streamed \u00e9 ' * 100
+        body = json.dumps({'username': 'test_user', 'password': 'test_password', 'content': content}).encode()
+
+        def call(path, headers, root_path='', chunk_size=100):
+            chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+            received, messages, dispatched = [], [], []
+
+            async def receive():
+                received.append(chunks[len(received)])
+                return {'type': 'http.request', 'body': received[-1], 'more_body': len(received) < len(chunks)}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {'type': 'http', 'method': 'POST', 'path': path, 'root_path': root_path, 'query_string': b'',
+                     'headers': [(b'content-type', b'application/json'), *headers]}
+            run = application.run
+            with mock.patch.object(application, 'buffer_size', 250), \
+                    mock.patch.object(application, 'run', side_effect=lambda *args: dispatched.append(len(received))
+                                      or run(*args)):
+                asyncio.run(application(scope, receive, send))
+            self.assertEqual(len(received), len(chunks))
+            return messages[0]['status'], dispatched
+
+        status, dispatched = call('/notes/create', [(b'content-length', str(len(body)).encode())])
+        self.assertEqual(status, 201)
+        # Only the first 250 bytes were read before the handler started; it read the rest itself
+        self.assertEqual(dispatched, [3])
+        # A chunked upload has no Content-Length and is read until the last message
+        self.assertEqual(call('/notes/create', [(b'transfer-encoding', b'chunked')])[0], 201)
+        # Behind a root path the server includes it in `path`; routing uses what follows it
+        self.assertEqual(call('/api/notes/create', [], root_path='/api')[0], 201)
+        with app.app_context():
+            self.assertEqual(list(db.session.scalars(db.select(Notes.post_content))), [content] * 3)
+
+    def test_list_notes(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            other_user = User(username='other_user', email='other@example.com', password='test_password')
+            db.session.add_all([user, other_user])
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            other_credentials = {'username': 'other_user', 'password': 'test_password'}
+            response = self.app.post('/notes/batch', json=dict(credentials, notes=[
+                {'content': f'Note {i}'} for i in range(5)]))
+            note_ids = [result['note_id'] for result in json.loads(response.data)['results']]
+            # Make the oldest note the most recently modified
+            self.app.put(f'/notes/{note_ids[0]}', json=dict(credentials, content='Note 0 edited'))
+
+            # Test walking the listing two notes at a time, without content
+            listed = []
+            cursor = ''
+            while cursor is not None:
+                response = self.app.get(f'/notes?limit=2&fields=note_id,last_modified&cursor={cursor}', json=credentials)
+                data = json.loads(response.data)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(all(set(note) == {'note_id', 'last_modified'} for note in data['notes']))
+                listed.extend(note['note_id'] for note in data['notes'])
+                cursor = data['next_cursor']
+            self.assertEqual(listed, [note_ids[0]] + sorted(note_ids[1:], reverse=True))
+
+            # Test the shared listing
+            self.app.post('/notes/share', json=dict(credentials, note_id=note_ids[2], shared_with_user_id=other_user.userid))
+            response = self.app.get('/notes/shared', json=other_credentials)
+            data = json.loads(response.data)
+            self.assertEqual(data['notes'][0]['note_id'], note_ids[2])
+            self.assertEqual(data['notes'][0]['content'], 'Note 2')
+            self.assertIsNone(data['next_cursor'])
+            response = self.app.get('/notes', json=other_credentials)
+            self.assertEqual(json.loads(response.data)['notes'], [])
+
+            # Test an unknown field
+            response = self.app.get('/notes?fields=password', json=credentials)
+            self.assertEqual(response.status_code, 400)
+
+    def test_metrics(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            response = self.app.post('/notes/create', json=dict(credentials, content='Test note'))
+            note_id = json.loads(response.data)['note_id']
+
+            # Test the N+1 warning and the slow request profiler on the same request
+            app.config['QUERY_COUNT_WARNING'] = 0
+            app.config['PROFILER_ENABLED'] = True
+            app.config['SLOW_REQUEST_SECONDS'] = 0
+            try:
+                with self.assertLogs(app.logger, level='WARNING') as logs:
+                    self.app.get(f'/notes/{note_id}', json=credentials)
+            finally:
+                app.config['QUERY_COUNT_WARNING'] = 20
+                app.config['PROFILER_ENABLED'] = False
+                app.config['SLOW_REQUEST_SECONDS'] = 0.5
+            self.assertTrue(any('possible N+1' in message for message in logs.output))
+            self.assertTrue(any('Slow request' in message for message in logs.output))
+
+            response = self.app.get('/metrics')
+            text = response.data.decode()
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('notes_http_request_duration_seconds_bucket{route="/notes/<int:note_id>",method="GET",le="+Inf"}',
+                          text)
+            self.assertIn('notes_http_requests_total{route="/notes/create",method="POST",status="201"}', text)
+            self.assertIn('notes_db_queries_per_request_count{route="/notes/create"}', text)
+
+    def test_streamed_serialization(self):
+        with app.app_context():
+            user = User(username='test_user', email='test@example.com', password='test_password')
+            db.session.add(user)
+            db.session.commit()
+            credentials = {'username': 'test_user', 'password': 'test_password'}
+            content = 'Large "quoted" note \u00e9\u4e2d\n\t\\ ' * 50
+            response = self.app.post('/notes/create', json=dict(credentials, content=content))
+            note_id = json.loads(response.data)['note_id']
+            self.app.put(f'/notes/{note_id}', json=dict(credentials, content='Small'))
+            self.app.put(f'/notes/{note_id}', json=dict(credentials, content=content))
+
+            expected_history = json.loads(self.app.get(f'/notes/version-history/{note_id}', json=credentials).data)
+            app.config['STREAM_THRESHOLD'] = 100
+            try:
+                # Test both the orjson encoder and the standard library fallback
+                for encoder in (serialization.orjson, None):
+                    with mock.patch.object(serialization, 'orjson', encoder):
+                        response = self.app.get(f'/notes/{note_id}', json=credentials)
+                        self.assertTrue(response.is_streamed)
+                        self.assertEqual(json.loads(response.data), {'note_id': note_id, 'content': content})
+                        response = self.app.get(f'/notes/version-history/{note_id}', json=credentials)
+                        self.assertEqual(json.loads(response.data), expected_history)
+            finally:
+                app.config['STREAM_THRESHOLD'] = 256 * 1024
+
+    @unittest.skipIf(serialization.orjson is None, 'orjson is not installed')
+    def test_jsonify_uses_orjson(self):
+        with app.app_context():
+            payload = {'b': datetime(2024, 1, 2, 3, 4, 5), 'a': ['\u00e9', 1.5, None]}
+            expected = '{"a":["\\u00e9",1.5,null],"b":"Tue, 02 Jan 2024 03:04:05 GMT"}'
+            for debug in (False, True):
+                app.config['DEBUG'] = debug
+                try:
+                    with mock.patch.object(serialization.orjson, 'dumps',
+                                           wraps=serialization.orjson.dumps) as dumps:
+                        body = app.json.response(payload).get_data(as_text=True)
+                    self.assertEqual(dumps.call_count, 1)
+                finally:
+                    app.config['DEBUG'] = False
+                # Sorted keys and HTTP dates like the standard library encoder, indented in debug mode
+                self.assertEqual(json.loads(body), json.loads(expected))
+                self.assertEqual(body.startswith('{\n  "a"'), debug)
+                if not debug:
+                    self.assertEqual(body, '{"a":["\u00e9",1.5,null],"b":"Tue, 02 Jan 2024 03:04:05 GMT"}\n')
+
+
+# WSGI callable that forwards each request to an ASGI application, the way an ASGI server would
+def call_asgi(environ, start_response):
+    body = environ['wsgi.input'].read()
+    headers = [(key[5:].replace('_', '-').lower().encode('latin-1'), value.encode('latin-1'))
+               for key, value in environ.items() if key.startswith('HTTP_')]
+    headers += [(key.replace('_', '-').lower().encode('latin-1'), environ[key].encode('latin-1'))
+                for key in ('CONTENT_TYPE', 'CONTENT_LENGTH') if environ.get(key)]
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': environ['REQUEST_METHOD'],
+             'scheme': environ['wsgi.url_scheme'], 'path': environ['PATH_INFO'], 'root_path': '',
+             'query_string': environ['QUERY_STRING'].encode('latin-1'), 'headers': headers,
+             'server': (environ['SERVER_NAME'], int(environ['SERVER_PORT'])), 'client': (environ.get('REMOTE_ADDR', '127.0.0.1'), 50000)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    start = messages[0]
+    start_response(str(start['status']), [(name.decode('latin-1'), value.decode('latin-1'))
+                                          for name, value in start['headers']])
+    # A generator, so responses the app streamed are reported as streamed
+    return (message['body'] for message in messages[1:])
+
+
+# Runs every test again through asgi.application
+class TestAPIOverASGI(TestAPI):
+
+    def setUp(self):
+        super().setUp()
+        self.app = Client(call_asgi, app.response_class)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,191 @@
+import difflib
+import json
+import re
+
+
+# Encode the changes from old to new as a compact JSON list of line operations:
+# a positive int copies that many lines, a negative int skips them and a string is inserted
+def make_delta(old, new):
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(''.join(new_lines[j1:j2]))
+    return json.dumps(ops, separators=(',', ':'))
+
+
+# Rebuild the new text from the old text and a delta produced by make_delta
+def apply_delta(old, delta):
+    old_lines = old.splitlines(keepends=True)
+    position = 0
+    parts = []
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.extend(old_lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(parts)
+
+
+# Line breaks other than \n and \r\n that str.splitlines also splits on. Deltas built from \n-separated lines
+# are only valid for text without them.
+OTHER_LINE_BREAKS = '\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+HUNK_HEADER = re.compile(r'@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@')
+
+
+class PatchError(ValueError):
+    pass
+
+
+# Split after each \n only; str.splitlines gives the same result, faster, when there are no other line breaks
+def split_lines(text):
+    if not has_other_line_breaks(text):
+        return text.splitlines(keepends=True)
+    return re.findall(r'[^\n]*\n|[^\n]+$', text)
+
+
+def count_lines(text, start, end):
+    lines = text.count('\n', start, end)
+    if end == len(text) and end > start and text[end - 1] != '\n':
+        lines += 1
+    return lines
+
+
+def add_op(ops, op):
+    if ops and type(ops[-1]) is type(op) and (isinstance(op, str) or (ops[-1] > 0) == (op > 0)):
+        ops[-1] += op
+    elif op:
+        ops.append(op)
+
+
+# Apply character range edits, each {"start": i, "end": j, "text": "..."} with offsets into `old`,
+# returning the new text and its delta. Only the lines the edits touch are examined.
+def apply_edits(old, edits):
+    ranges = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise PatchError('Each edit must be an object with start, end and text')
+        start, end, text = edit.get('start'), edit.get('end', edit.get('start')), edit.get('text', '')
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in (start, end)) \
+                or not isinstance(text, str) or not 0 <= start <= end <= len(old):
+            raise PatchError(f'Invalid edit range {start}-{end} for a note of length {len(old)}')
+        ranges.append((start, end, text))
+    ranges.sort(key=lambda edit: (edit[0], edit[1]))
+    for (_, previous_end, _), (start, _, _) in zip(ranges, ranges[1:]):
+        if start < previous_end:
+            raise PatchError('Edits must not overlap')
+
+    parts = []
+    ops = []
+    position = 0
+    index = 0
+    while index < len(ranges):
+        # Group the edits that touch the same lines and rewrite those lines whole
+        line_start = old.rfind('\n', 0, ranges[index][0]) + 1
+        group = []
+        line_end = line_start
+        while index < len(ranges) and (not group or old.rfind('\n', 0, ranges[index][0]) + 1 < line_end):
+            group.append(ranges[index])
+            next_break = old.find('\n', ranges[index][1])
+            line_end = len(old) if next_break < 0 else next_break + 1
+            index += 1
+        segment = []
+        cursor = line_start
+        for start, end, text in group:
+            segment.append(old[cursor:start])
+            segment.append(text)
+            cursor = end
+        segment.append(old[cursor:line_end])
+        parts.append(old[position:line_start])
+        parts.extend(segment)
+        add_op(ops, count_lines(old, position, line_start))
+        add_op(ops, -count_lines(old, line_start, line_end))
+        add_op(ops, ''.join(segment))
+        position = line_end
+    parts.append(old[position:])
+    add_op(ops, count_lines(old, position, len(old)))
+    new = ''.join(parts)
+    return new, encode_delta(old, new, ops)
+
+
+# Apply a unified diff (as produced by `diff -u` or difflib.unified_diff) to `old`, checking its context lines,
+# and return the new text and its delta
+def apply_unified_diff(old, diff):
+    old_lines = split_lines(old)
+    ops = []
+    position = 0
+    lines = split_lines(diff)
+    index = 0
+    while index < len(lines) and not lines[index].startswith('@@'):
+        index += 1
+    if index == len(lines):
+        raise PatchError('The diff has no hunks')
+    while index < len(lines):
+        header = HUNK_HEADER.match(lines[index])
+        if not header:
+            raise PatchError(f'Invalid hunk header: {lines[index].rstrip()}')
+        old_start, old_count = int(header.group(1)), int(header.group(2) or 1)
+        # A hunk that removes nothing is anchored after line old_start rather than at it
+        hunk_start = old_start if old_count == 0 else old_start - 1
+        if hunk_start < position or hunk_start > len(old_lines):
+            raise PatchError(f'Hunk at line {old_start} does not apply')
+        add_op(ops, hunk_start - position)
+        position = hunk_start
+        index += 1
+        while index < len(lines) and not lines[index].startswith('@@'):
+            kind, text = lines[index][:1], lines[index][1:]
+            if kind == '\n':
+                # Some tools strip the space from empty context lines
+                kind, text = ' ', '\n'
+            index += 1
+            if index < len(lines) and lines[index].startswith('\\'):
+                # "\ No newline at end of file" applies to the line before it
+                text = text.rstrip('\n')
+                index += 1
+            if kind == '+':
+                add_op(ops, text)
+                continue
+            if kind not in (' ', '-'):
+                raise PatchError(f'Invalid diff line: {kind}{text.rstrip()}')
+            if position >= len(old_lines) or old_lines[position] != text:
+                raise PatchError(f'Hunk at line {old_start} does not apply')
+            add_op(ops, 1 if kind == ' ' else -1)
+            position += 1
+    add_op(ops, len(old_lines) - position)
+
+    parts = []
+    position = 0
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.extend(old_lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    new = ''.join(parts)
+    return new, encode_delta(old, new, ops)
+
+
+# Scans with str methods rather than a regex, which is an order of magnitude slower on large notes
+def has_other_line_breaks(text):
+    if '\r' in text and text.count('\r') != text.count('\r\n'):
+        return True
+    return any(char in text for char in OTHER_LINE_BREAKS)
+
+
+# Delta ops computed over \n-separated lines, or a full diff when the text has other line breaks
+def encode_delta(old, new, ops):
+    if has_other_line_breaks(old):
+        return make_delta(old, new)
+    return json.dumps(ops, separators=(',', ':'))